@@ -11,8 +11,6 @@ from django import forms
 from django.conf import settings
 from django.core.files import File
 
-from lightkurve.io.tess import read_tess_lightcurve
-
 import numpy
 
 import tom_dataproducts.single_target_data_service.single_target_data_service as stds
@@ -21,6 +19,7 @@ from tom_dataproducts.data_processor import run_data_processor, DataProcessor
 from tom_dataproducts.exceptions import InvalidFileFormatException
 from tom_dataproducts.models import DataProduct
 
+from zooniverse.lightcurve import read_tess_lightcurve_columns
 
 logger = logging.getLogger(__name__)
 
@@ -76,10 +75,10 @@ class TessProcessor(DataProcessor):
 
     def process_data(self, data_product):
         """
-        Reads a TESS light curve with lightkurve and returns photometry as tuples.
+        Reads a TESS light curve and returns photometry as tuples.
         """
 
-        ts = read_tess_lightcurve(data_product.data.path)
+        ts = read_tess_lightcurve_columns(data_product.data.path)
         ts = ts[~ts["flux"].mask & ~ts["flux_err"].mask]
         ts = ts.bin(time_bin_size=DEFAULT_BIN_SIZE)
         ts = ts[~numpy.isnan(ts["flux"]) & ~numpy.isnan(ts["flux_err"])]
@@ -356,6 +356,29 @@ ZOONIVERSE_CLIENT_SECRET = os.environ.get("ZOONIVERSE_CLIENT_SECRET")
 ZOONIVERSE_COMMIT_CHANGES = False
 ZOONIVERSE_PROJECT_ID = 14770
 ZOONIVERSE_WORKFLOW_ID = 25070
+# Local copies of the subject and classification exports. Set to None to always stream them from Panoptes.
+ZOONIVERSE_EXPORT_CACHE_DIR = os.environ.get(
+    "ZOONIVERSE_EXPORT_CACHE_DIR",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", tempfile.gettempdir()), "zooniverse_exports"
+    ),
+)
+# Local copies of light curve files, up to LIGHTCURVE_CACHE_SIZE bytes. Set to None to always read them from their URLs.
+LIGHTCURVE_CACHE_DIR = os.environ.get(
+    "LIGHTCURVE_CACHE_DIR",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", tempfile.gettempdir()), "lightcurves"
+    ),
+)
+LIGHTCURVE_CACHE_SIZE = int(os.environ.get("LIGHTCURVE_CACHE_SIZE", 20 * 2**30))
+# Preprocessed light curves (see zooniverse.lightcurve_store), up to LIGHTCURVE_STORE_SIZE bytes. Set to None to always read the original files.
+LIGHTCURVE_STORE_DIR = os.environ.get(
+    "LIGHTCURVE_STORE_DIR",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", tempfile.gettempdir()), "lightcurve_store"
+    ),
+)
+LIGHTCURVE_STORE_SIZE = int(os.environ.get("LIGHTCURVE_STORE_SIZE", 20 * 2**30))
 
 if "SENTRY_DSN" in os.environ:
     import sentry_sdk
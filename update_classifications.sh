@@ -7,6 +7,7 @@ $MGMT fetch_subjects $SETTINGS --generate
 
 $MGMT fetch_classifications $SETTINGS --generate
 
-$MGMT prune_stale_aggregations $SETTINGS
+$MGMT prefetch_lightcurves $SETTINGS
 
-$MGMT aggregate_targets $SETTINGS
\ No newline at end of file
+$MGMT aggregate_targets $SETTINGS
+$MGMT compact_reductions $SETTINGS
\ No newline at end of file
@@ -1,72 +1,170 @@
-from collections import defaultdict
+import logging
+import time
+
+from contextlib import contextmanager
 from functools import cached_property
 
 import numpy
 
 from astropy.time import Time
 
-from zooniverse.models import ZooniverseTarget, ZooniverseTargetReduction
+from django.db.models import Max
+
+from zooniverse.models import (
+    ZooniverseAggregationQueueEntry,
+    ZooniverseMark,
+    ZooniverseTarget,
+    ZooniverseTargetReduction,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def grouped_medians(keys, *columns):
+    """
+    Groups the values in each column by the corresponding keys, and takes the median of each
+    group. Returns the sorted unique keys, the size of each group, and an array of medians per
+    key for each column.
+
+    Each column is sorted once by key and value, so that every group is a contiguous run with
+    its median in the middle, rather than collecting groups in Python lists.
+    """
+    keys = numpy.asarray(keys)
+    unique_keys, starts, counts = numpy.unique(
+        numpy.sort(keys), return_index=True, return_counts=True
+    )
+    lower = starts + (counts - 1) // 2
+    upper = starts + counts // 2
+    medians = []
+    for column in columns:
+        values = numpy.asarray(column, dtype=numpy.float64)[
+            numpy.lexsort((column, keys))
+        ]
+        medians.append((values[lower] + values[upper]) / 2)
+    return unique_keys, counts, medians
+
+
+class TargetContext(object):
+    """
+    Holds what's needed to process a target, so that its light curve is only loaded once
+    however many steps (aggregation, saving the reduction, rendering its image) use it.
+
+    Steps can be timed with timed(). Each step's time excludes any steps timed within it,
+    so e.g. loading the light curve isn't counted as part of the step which first uses it.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.timings = {}
+        self._timing = []
+
+    @cached_property
+    def data(self):
+        with self.timed("load"):
+            return self.target.fetch_data()
+
+    @contextmanager
+    def timed(self, step):
+        start = time.perf_counter()
+        self._timing.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._timing.pop()
+            self.timings[step] = self.timings.get(step, 0.0) + elapsed - nested
+            if len(self._timing) > 0:
+                self._timing[-1] += elapsed
+
+    @property
+    def data_unavailable(self):
+        """
+        Whether the light curve was needed but couldn't be loaded.
+        """
+        return "data" in self.__dict__ and self.data is None
+
+    def timings_summary(self):
+        return ", ".join(f"{step} {t:.2f}s" for step, t in self.timings.items())
 
 
 class TargetAggregator(object):
     """
     Base class for target aggregation. Project-specific logic should be implemented in a subclass.
+
+    The target's light curve is loaded through a TargetContext, which can be given to share
+    it with other steps.
     """
 
     MIN_ANNOTATIONS = 5
 
-    def __init__(self, target):
+    def __init__(self, target, context=None):
         if type(target) is int:
-            self.target = ZooniverseTarget.objects.get(target)
+            self.target = ZooniverseTarget.objects.get(pk=target)
         else:
             self.target = target
+        if context is None:
+            context = TargetContext(self.target)
+        self.context = context
 
     def aggregated_annotations(self):
-        x_mins, x_mids, x_maxs, groups = (
-            defaultdict(list),
-            defaultdict(list),
-            defaultdict(list),
-            set(),
+        grouped = self.grouped_annotations(self.target.classifications())
+        if grouped is None:
+            return None
+        return self.reduce(grouped)
+
+    def grouped_annotations(self, classifications):
+        """
+        Groups the annotations from the given classifications. Returns a dict of arrays giving
+        the group (index) and x_min, x_mid and x_max of each annotation which was grouped.
+        """
+        x_mid, width = self.annotation_values(classifications)
+        x_min = x_mid - width
+        x_max = x_mid + width
+        groups = self.groups_between(x_min, x_max)
+
+        grouped = ~numpy.isnan(groups)
+        return {
+            "index": groups[grouped],
+            "x_min": x_min[grouped],
+            "x_mid": x_mid[grouped],
+            "x_max": x_max[grouped],
+        }
+
+    def reduce(self, grouped):
+        """
+        Reduces grouped annotations (see grouped_annotations) to the median of each group with
+        enough annotations.
+        """
+        index, counts, (x_min, x_mid, x_max) = grouped_medians(
+            grouped["index"], grouped["x_min"], grouped["x_mid"], grouped["x_max"]
         )
-        for annotation in self.annotations():
-            x_min = annotation["x"] - annotation["width"]
-            x_max = annotation["x"] + annotation["width"]
-            try:
-                group = self.group_between(x_min, x_max).jd
-            except ValueError:
-                continue
-            groups.add(group)
-            x_mids[group].append(annotation["x"])
-            x_mins[group].append(x_min)
-            x_maxs[group].append(x_max)
-        aggregated_annotations = defaultdict(list)
-        for group in groups:
-            n_annotations = len(x_mids[group])
-            if n_annotations < self.MIN_ANNOTATIONS:
-                continue
-            aggregated_annotations["x_min"].append(
-                Time(numpy.median(x_mins[group]), format="jd").jd
-            )
-            aggregated_annotations["x_mid"].append(
-                Time(numpy.median(x_mids[group]), format="jd").jd
-            )
-            aggregated_annotations["x_max"].append(
-                Time(numpy.median(x_maxs[group]), format="jd").jd
-            )
-            aggregated_annotations["width"].append(
-                aggregated_annotations["x_max"][-1]
-                - aggregated_annotations["x_min"][-1]
-            )
-            aggregated_annotations["annotations"].append(n_annotations)
-            aggregated_annotations["index"].append(group)
-        return aggregated_annotations
-
-    def annotations(self):
-        for annotation in self.target.annotations():
-            annotation = annotation[0]["value"]
-            if len(annotation) == 0:
-                continue
-            yield annotation[0]
+        keep = counts >= self.MIN_ANNOTATIONS
+        if not numpy.any(keep):
+            return {}
+        return {
+            "x_min": x_min[keep].tolist(),
+            "x_mid": x_mid[keep].tolist(),
+            "x_max": x_max[keep].tolist(),
+            "width": (x_max[keep] - x_min[keep]).tolist(),
+            "annotations": counts[keep].tolist(),
+            "index": index[keep].tolist(),
+        }
+
+    def annotation_values(self, classifications=None):
+        """
+        Returns arrays of the x and width of the first mark in each of the classifications
+        (skipping any without one). These are read from the classifications' ZooniverseMarks,
+        rather than fetching and decoding each annotation.
+        """
+        if classifications is None:
+            classifications = self.target.classifications()
+        values = numpy.array(
+            ZooniverseMark.objects.filter(
+                classification__in=classifications, task_index=0, mark_index=0
+            ).values_list("x", "width"),
+            dtype=numpy.float64,
+        ).reshape(-1, 2)
+        return values[:, 0], values[:, 1]
 
     def group_between(self, x_min, x_max):
         """
@@ -75,21 +173,88 @@ class TargetAggregator(object):
         """
         raise NotImplementedError
 
+    def groups_between(self, x_mins, x_maxs):
+        """
+        Takes arrays of minimum and maximum times (as JD) and returns an array of the grouped
+        time for each pair, or NaN where there isn't one. Subclasses can override this to
+        group all the annotations at once, rather than one at a time with group_between.
+        """
+        groups = numpy.full(len(x_mins), numpy.nan)
+        for i, (x_min, x_max) in enumerate(zip(x_mins.tolist(), x_maxs.tolist())):
+            try:
+                groups[i] = self.group_between(x_min, x_max).jd
+            except ValueError:
+                continue
+        return groups
+
     def save(self):
-        aggregated_annotations = self.aggregated_annotations()
-        if aggregated_annotations is None:
+        """
+        Aggregates all of the target's classifications into a new ZooniverseTargetReduction.
+        The grouped annotations are kept on the reduction, so that it can be updated later.
+        """
+        classifications, last_classification = self._classifications_up_to_now(
+            self.target.classifications()
+        )
+        grouped = self.grouped_annotations(classifications)
+        if grouped is None:
             return None
         tr = ZooniverseTargetReduction.objects.create(
             target=self.target,
-            reduced_annotations=aggregated_annotations,
+            last_classification=last_classification,
+            classification_count=classifications.count(),
+            reduced_annotations=self.reduce(grouped),
+            state=self._state(grouped),
         )
-        tr.classifications.set(
-            list(self.target.classifications().values_list("pk", flat=True))
+        # Only the pointer is written, rather than saving the whole target
+        ZooniverseTarget.objects.filter(pk=self.target.pk).update(latest_reduction=tr)
+        self.target.latest_reduction = tr
+        return tr
+
+    def update(self, reduction):
+        """
+        Folds any classifications made since the reduction was saved into it, rather than
+        aggregating all of the target's classifications again. Returns the reduction if it
+        was updated, or None if there was nothing to do or the light curve couldn't be loaded.
+
+        Reductions saved without their grouped annotations are replaced by a new one.
+        """
+        if reduction.state is None:
+            return self.save()
+        classifications, last_classification = self._classifications_up_to_now(
+            self.target.classifications().filter(
+                pk__gt=reduction.last_classification or 0
+            )
         )
+        if last_classification is None:
+            return None
+        grouped = self.grouped_annotations(classifications)
+        if grouped is None:
+            return None
+        grouped = {
+            k: numpy.concatenate([numpy.asarray(reduction.state[k]), v])
+            for k, v in grouped.items()
+        }
+        reduction.last_classification = last_classification
+        reduction.classification_count += classifications.count()
+        reduction.reduced_annotations = self.reduce(grouped)
+        reduction.state = self._state(grouped)
+        reduction.save()
+        return reduction
 
-    @cached_property
+    def _classifications_up_to_now(self, classifications):
+        # Pin the classifications to the ones which exist now, in case more are imported
+        # while aggregating
+        last_classification = classifications.aggregate(Max("pk"))["pk__max"]
+        if last_classification is None:
+            return classifications, None
+        return classifications.filter(pk__lte=last_classification), last_classification
+
+    def _state(self, grouped):
+        return {k: v.tolist() for k, v in grouped.items()}
+
+    @property
     def target_data(self):
-        return self.target.fetch_data()
+        return self.context.data
 
 
 class PeakGrouperTargetAggregator(TargetAggregator):
@@ -98,10 +263,17 @@ class PeakGrouperTargetAggregator(TargetAggregator):
     contained in each annotation. Suitable for stellar pulsations, microlensing, etc.
     """
 
-    def aggregated_annotations(self):
+    def grouped_annotations(self, classifications):
         if self.target_data is None:
             return None
-        return super().aggregated_annotations()
+        return super().grouped_annotations(classifications)
+
+    @cached_property
+    def peak_finder(self):
+        return PeakFinder(self.target_data)
+
+    def groups_between(self, x_mins, x_maxs):
+        return self.peak_finder.peaks_between(x_mins, x_maxs)
 
     def data_between(self, start_time, end_time):
         return self.target_data[
@@ -116,3 +288,140 @@ class PeakGrouperTargetAggregator(TargetAggregator):
             x_max = Time(x_max, format="jd")
         data = self.data_between(x_min, x_max)
         return data[numpy.argmax(data["flux"])]["time"]
+
+
+class PeakFinder(object):
+    """
+    Finds the time of the highest flux within each of a set of time ranges in a light curve,
+    for all of the ranges at once.
+
+    The light curve's times and fluxes are converted to float arrays once. The rows in each
+    range are found with a binary search, and the peak within it from a sparse table of the
+    position of the highest flux in every power-of-two length run of rows, so each range
+    takes constant time regardless of its length.
+
+    This gives the same results as PeakGrouperTargetAggregator.group_between: ranges are
+    given as UTC JD and compared with the light curve times in their own time scale, masked
+    fluxes are ignored, ties go to the earliest row, and a range containing only masked
+    fluxes gives its first row.
+    """
+
+    def __init__(self, timeseries):
+        times = timeseries["time"]
+        self.scale = times.scale
+        self.group_times = numpy.asarray(times.jd, dtype=numpy.float64)
+        # Times are kept relative to the first one, to keep full precision as a single float
+        self.reference = times.jd1[0] if len(times) > 0 else 0.0
+        self.times = (times.jd1 - self.reference) + times.jd2
+
+        flux = timeseries["flux"]
+        self.flux = numpy.array(getattr(flux, "unmasked", flux), dtype=numpy.float64)
+        self.flux[
+            numpy.asarray(getattr(flux, "mask", False)) | numpy.isnan(self.flux)
+        ] = -numpy.inf
+
+        if numpy.any(numpy.diff(self.times) < 0):
+            order = numpy.argsort(self.times, kind="stable")
+            self.times = self.times[order]
+            self.group_times = self.group_times[order]
+            self.flux = self.flux[order]
+
+        # self.peaks[k][i] is the index of the peak in the rows i to i + 2**k - 1
+        self.peaks = [numpy.arange(len(self.flux))]
+        k = 1
+        while 2**k <= len(self.flux):
+            previous = self.peaks[-1]
+            n = len(self.flux) - 2**k + 1
+            first = previous[:n]
+            second = previous[2 ** (k - 1) : 2 ** (k - 1) + n]
+            self.peaks.append(
+                numpy.where(self.flux[second] > self.flux[first], second, first)
+            )
+            k += 1
+
+    def peaks_between(self, start_times, end_times):
+        """
+        Returns the JD of the peak between each pair of start and end times, or NaN where
+        there are no data between them.
+        """
+        groups = numpy.full(len(start_times), numpy.nan)
+        if len(start_times) == 0 or len(self.times) == 0:
+            return groups
+        starts = self._relative_times(start_times)
+        ends = self._relative_times(end_times)
+        lo = numpy.searchsorted(self.times, starts, side="left")
+        hi = numpy.searchsorted(self.times, ends, side="right")
+        has_data = hi > lo
+        groups[has_data] = self.group_times[self.argmax(lo[has_data], hi[has_data])]
+        return groups
+
+    def argmax(self, lo, hi):
+        """
+        Returns the index of the peak in each of the (non-empty) ranges of rows lo to hi - 1.
+        """
+        peaks = numpy.empty(len(lo), dtype=numpy.intp)
+        levels = numpy.floor(numpy.log2(hi - lo)).astype(int)
+        for k in numpy.unique(levels):
+            in_level = levels == k
+            # Two (possibly overlapping) runs of 2**k rows together cover the range
+            first = self.peaks[k][lo[in_level]]
+            second = self.peaks[k][hi[in_level] - 2**k]
+            first_flux, second_flux = self.flux[first], self.flux[second]
+            peaks[in_level] = numpy.where(
+                (second_flux > first_flux)
+                | ((second_flux == first_flux) & (second < first)),
+                second,
+                first,
+            )
+        return peaks
+
+    def _relative_times(self, jd):
+        times = getattr(Time(jd, format="jd"), self.scale)
+        return (times.jd1 - self.reference) + times.jd2
+
+
+def aggregate_target(
+    target_id, update=False, aggregator_class=PeakGrouperTargetAggregator
+):
+    """
+    Aggregates a target if it hasn't been aggregated yet, or if update is set, folds new
+    classifications into its latest reduction. The target's light curve image is regenerated
+    if its reduction changed, and the target is removed from the aggregation queue once its
+    classifications are all included. Returns True if the reduction changed.
+
+    The light curve is loaded (at most) once for all of this, and the time taken by each step
+    is logged.
+
+    The target is claimed for the duration, so that it's safe for several workers to be given
+    the same target: any which can't claim it skip it.
+    """
+    target = ZooniverseTarget.claim_for_aggregation(target_id)
+    if target is None:
+        return False
+    context = TargetContext(target)
+    try:
+        with context.timed("aggregate"):
+            tr = target.latest_reduction
+            if tr is None:
+                tr = aggregator_class(target, context).save()
+            elif update:
+                tr = aggregator_class(target, context).update(tr)
+            else:
+                tr = None
+        if tr is not None:
+            with context.timed("render"):
+                if target.generated_lightcurve_image:
+                    target.generated_lightcurve_image.delete()
+                target.generate_lightcurve_image(data=context.data)
+        # Targets whose light curve couldn't be loaded stay queued, to be retried
+        if tr is not None or (update and not context.data_unavailable):
+            ZooniverseAggregationQueueEntry.dequeue(
+                target.pk, target.aggregation_started
+            )
+        return tr is not None
+    finally:
+        target.release_aggregation_claim()
+        logger.info(
+            f"Processed {target} in {sum(context.timings.values()):.2f}s "
+            f"({context.timings_summary()})"
+        )
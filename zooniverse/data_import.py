@@ -1,17 +1,30 @@
 import json
 import logging
+import numpy
 import requests
 import time
 
+from collections import Counter, deque
+from contextlib import nullcontext
+from itertools import chain
+from multiprocessing import Pool
+
 from dateutil.parser import parse as date_parse
 
 from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
 
 from tqdm import tqdm
 
 from zooniverse.client import project, workflow
+from zooniverse.exports import get_export, local_export
+from zooniverse.loaders import AUTO, get_loader
 from zooniverse.models import (
+    ZooniverseAggregationQueueEntry,
     ZooniverseClassification,
+    ZooniverseImportState,
+    ZooniverseMark,
     ZooniverseSubject,
     ZooniverseTarget,
     ZooniverseSurvey,
@@ -33,84 +46,481 @@ def generate_classification_export(wait=False):
         workflow.wait_export("classifications")
 
 
-def get_subject_export():
-    return project.get_export("subjects").csv_dictreader()
+def get_subject_export(path=None):
+    if path is not None:
+        return local_export(path)
+    return get_export(project, "subjects")
+
+
+def get_classification_export(path=None):
+    if path is not None:
+        return local_export(path)
+    return get_export(workflow, "classifications")
+
+
+class ClassificationIdIndex(object):
+    """
+    Compact lookup of classification IDs which have already been imported. IDs are held in a
+    sorted int64 array (8 bytes each) and looked up with a binary search.
+    """
+
+    def __init__(self, classification_ids, count=-1):
+        self.ids = numpy.fromiter(classification_ids, dtype=numpy.int64, count=count)
+        self.ids.sort()
+
+    @classmethod
+    def from_queryset(cls, *querysets):
+        """
+        Builds an index of the classifications in the given querysets, which mustn't overlap.
+        """
+        return cls(
+            chain.from_iterable(
+                queryset.values_list("classification_id", flat=True).iterator(
+                    chunk_size=10000
+                )
+                for queryset in querysets
+            ),
+            count=sum(queryset.count() for queryset in querysets),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, classification_id):
+        i = self.ids.searchsorted(classification_id)
+        return i < len(self.ids) and self.ids[i] == classification_id
+
+
+def annotation_marks(annotation):
+    """
+    Yields the marked intervals in a decoded annotation, as ZooniverseMark field dicts
+    (without the classification).
+    """
+    for task_index, task in enumerate(annotation):
+        if "task" not in task or not isinstance(task.get("value"), list):
+            continue
+        for mark_index, mark in enumerate(task["value"]):
+            if not isinstance(mark, dict) or "x" not in mark or "width" not in mark:
+                continue
+            yield {
+                "task": task["task"],
+                "task_index": task_index,
+                "mark_index": mark_index,
+                "tool": mark.get("tool"),
+                "x": mark["x"],
+                "width": mark["width"],
+            }
+
+
+class ClassificationParser(object):
+    """
+    Filters a chunk of classification export rows down to the ones which need importing and
+    prepares them for the loader. This doesn't touch the database, so that it can be run in
+    worker processes.
+
+    Rows at or below the watermark are skipped, except for those of retry_subjects (subjects
+    which classifications were skipped for on an earlier import, and which have since been
+    imported).
+
+    Returns the prepared rows, a list of the prepared ZooniverseMark rows for each of them
+    (if given a mark_loader), the highest classification ID seen, for updating the
+    watermark, and the set of unknown subjects which classifications were skipped for.
+    """
+
+    def __init__(
+        self,
+        watermark,
+        existing_classifications,
+        existing_subjects,
+        loader,
+        warn_missing_subjects=False,
+        mark_loader=None,
+        retry_subjects=frozenset(),
+    ):
+        self.watermark = watermark
+        self.existing_classifications = existing_classifications
+        self.existing_subjects = existing_subjects
+        self.loader = loader
+        self.warn_missing_subjects = warn_missing_subjects
+        self.mark_loader = mark_loader
+        self.retry_subjects = retry_subjects
+
+    def __call__(self, rows):
+        new_classifications = []
+        new_marks = []
+        max_classification_id = self.watermark
+        skipped_subject_ids = set()
+        for c in rows:
+            classification_id = int(c["classification_id"])
+
+            if classification_id <= self.watermark:
+                if (
+                    len(self.retry_subjects) == 0
+                    or int(c["subject_ids"]) not in self.retry_subjects
+                ):
+                    continue
+            max_classification_id = max(max_classification_id, classification_id)
+
+            if classification_id in self.existing_classifications:
+                continue
+
+            subject_id = int(c["subject_ids"])
+            if subject_id not in self.existing_subjects:
+                if self.warn_missing_subjects:
+                    logger.warning(
+                        f"Skipping classification {classification_id} for unknown subject {subject_id}"
+                    )
+                skipped_subject_ids.add(subject_id)
+                continue
+
+            user_id = c["user_id"]
+            if len(user_id) == 0:
+                user_id = None
+            else:
+                user_id = int(user_id)
+
+            classification = self.loader.prepare(
+                {
+                    "classification_id": classification_id,
+                    "subject_id": self.existing_subjects[subject_id],
+                    "user_id": user_id,
+                    "timestamp": c["created_at"],
+                    "annotation": c["annotations"],
+                    "marks_extracted": self.mark_loader is not None,
+                }
+            )
+            new_classifications.append(classification)
+            if self.mark_loader is not None:
+                # The ORM loader has already decoded the annotation, so it's reused
+                annotation = self.loader.json_value(classification, "annotation")
+                new_marks.append(
+                    [
+                        self.mark_loader.prepare(
+                            dict(mark, classification_id=classification_id)
+                        )
+                        for mark in annotation_marks(annotation)
+                    ]
+                )
+        return (
+            new_classifications,
+            new_marks,
+            max_classification_id,
+            skipped_subject_ids,
+        )
+
+
+_parser = None
+
 
+def _init_parser(parser):
+    global _parser
+    _parser = parser
 
-def get_classification_export():
-    return workflow.get_export("classifications").csv_dictreader()
 
+def _parse(rows):
+    return _parser(rows)
 
-def import_classifications(limit=None, warn_missing_subjects=False):
+
+def import_classifications(
+    limit=None,
+    warn_missing_subjects=False,
+    full=False,
+    loader=AUTO,
+    workers=1,
+    export_path=None,
+):
     """
     Downloads the latest workflow classifications export and creates new ZooniverseClassification
     objects based on it.
+
+    Rows at or below the workflow's stored watermark are skipped before any parsing. The
+    watermark is only advanced after a complete pass through the export. Classifications of
+    subjects which haven't been imported are skipped, and their subjects are recorded so that
+    once a subject has been imported the rows for it below the watermark are read again. Set
+    full to ignore the watermark and re-check the whole export.
+
+    A checkpoint is saved after each batch is written. If the download fails it's resumed
+    from where it stopped, and if the import is interrupted the next run against the same
+    export carries on from the last checkpoint.
+
+    New classifications are written by the given loader (see zooniverse.loaders), along with
+    a ZooniverseMark for each marked interval in their annotations. By default this streams
+    them in with COPY on PostgreSQL, and uses bulk_create elsewhere. Their targets are added
+    to the aggregation queue.
+
+    The export is read in chunks which are parsed by a ClassificationParser. With more than
+    one worker, chunks are parsed in a pool of that many processes while this process carries
+    on reading the export and writes the results in order.
+
+    If the export hasn't changed since it was last completely imported, and none of the
+    skipped subjects have been imported since, nothing is done. To import from a local copy of
+    an export instead of the latest one, give its export_path.
     """
     BATCH_SIZE = 1e5
+    CHUNK_SIZE = 10000
+    RETRY_SUBJECTS_CHUNK_SIZE = 500
+
+    import_state, _ = ZooniverseImportState.objects.get_or_create(
+        export_type=ZooniverseImportState.CLASSIFICATIONS,
+        source_id=settings.ZOONIVERSE_WORKFLOW_ID,
+    )
+    watermark = 0 if full else import_state.watermark
+
+    existing_subjects = dict(
+        ZooniverseSubject.objects.all().values_list("subject_id", "pk")
+    )
+    if full:
+        retry_subjects = set()
+        skipped_subject_ids = set()
+    else:
+        retry_subjects = (
+            set(import_state.skipped_subject_ids) & existing_subjects.keys()
+        )
+        skipped_subject_ids = set(import_state.skipped_subject_ids) - retry_subjects
+
+    export = get_classification_export(export_path)
+    if (
+        not full
+        and len(retry_subjects) == 0
+        and export.sha256 is not None
+        and export.sha256 == import_state.export_sha256
+    ):
+        logger.info("Classification export is unchanged since the last import")
+        return 0
+
+    max_classification_id = watermark
+    checkpoint = import_state.checkpoint
+    if (
+        not full
+        and checkpoint is not None
+        and checkpoint["export"] == export.identifier
+    ):
+        logger.info(f"Resuming classification import from byte {checkpoint['offset']}")
+        export.offset = checkpoint["offset"]
+        if export.offset > 0:
+            # Otherwise the header hasn't been read past, and is read again
+            export.fieldnames = checkpoint["fieldnames"]
+        max_classification_id = checkpoint["max_classification_id"]
+        skipped_subject_ids |= set(checkpoint.get("skipped_subject_ids", []))
+
+    # Byte offset in the export up to which every row has been written to the database
+    written_offset = export.offset
+    saved_skipped_count = len(skipped_subject_ids)
+
+    def save_checkpoint():
+        nonlocal saved_skipped_count
+        import_state.checkpoint = {
+            "export": export.identifier,
+            "offset": written_offset,
+            "fieldnames": export.fieldnames,
+            "max_classification_id": max_classification_id,
+        }
+        update_fields = ["checkpoint", "updated"]
+        if len(skipped_subject_ids) > saved_skipped_count:
+            # Only saved when more subjects have been skipped. The subjects being retried are
+            # kept until the export has been completely read, so that they're retried again
+            # if the import is resumed.
+            import_state.skipped_subject_ids = sorted(
+                skipped_subject_ids | retry_subjects
+            )
+            update_fields.append("skipped_subject_ids")
+            saved_skipped_count = len(skipped_subject_ids)
+        import_state.save(update_fields=update_fields)
+
+    mark_loader = get_loader(
+        ZooniverseMark,
+        ["classification_id", "task", "task_index", "mark_index", "tool", "x", "width"],
+        loader,
+    )
+    loader = get_loader(
+        ZooniverseClassification,
+        [
+            "classification_id",
+            "subject_id",
+            "user_id",
+            "timestamp",
+            "annotation",
+            "marks_extracted",
+        ],
+        loader,
+    )
+    existing_classifications = [
+        ZooniverseClassification.objects.filter(classification_id__gt=watermark)
+    ]
+    # Classifications of these subjects below the watermark are read again. They're looked
+    # up a chunk of subjects at a time, to keep within the database's limit on parameters.
+    retry_subject_pks = sorted(existing_subjects[s] for s in retry_subjects)
+    for i in range(0, len(retry_subject_pks), RETRY_SUBJECTS_CHUNK_SIZE):
+        existing_classifications.append(
+            ZooniverseClassification.objects.filter(
+                classification_id__lte=watermark,
+                subject_id__in=retry_subject_pks[i : i + RETRY_SUBJECTS_CHUNK_SIZE],
+            )
+        )
+    parser = ClassificationParser(
+        watermark,
+        ClassificationIdIndex.from_queryset(*existing_classifications),
+        existing_subjects,
+        loader,
+        warn_missing_subjects=warn_missing_subjects,
+        mark_loader=mark_loader,
+        retry_subjects=retry_subjects,
+    )
+
+    subject_targets = dict(ZooniverseSubject.objects.values_list("pk", "target_id"))
+
+    def load(classifications, marks):
+        # Classifications are skipped once they exist, so their marks are written and their
+        # targets queued along with them. Only the targets of classifications which were
+        # actually created are queued, as the COPY loader skips any which already exist.
+        with transaction.atomic():
+            loaded = loader.load(classifications, returning="subject_id")
+            mark_loader.load([mark for m in marks for mark in m])
+            ZooniverseAggregationQueueEntry.enqueue(
+                Counter(subject_targets[subject_id] for subject_id in loaded)
+            )
+        return len(loaded)
 
     total = 0
-    i = 0
-    with tqdm(total=limit) as pbar:
-        new_classifications = []
-        for attempt in range(5):
-            existing_classifications = list(
-                ZooniverseClassification.objects.all().values_list(
-                    "classification_id", flat=True
+    new_classifications = []
+    new_marks = []
+    batch_offset = written_offset
+    limit_reached = False
+    completed = False
+
+    def write(parsed, start_offset, end_offset):
+        """
+        Queues a parsed chunk for writing, and writes out the batch once it's full or the
+        limit has been reached.
+        """
+        nonlocal total, new_classifications, new_marks, batch_offset, written_offset
+        nonlocal max_classification_id, limit_reached
+        chunk_classifications, chunk_marks, chunk_max, chunk_skipped = parsed
+        if limit is not None:
+            remaining = limit - total - len(new_classifications)
+            if len(chunk_classifications) >= remaining:
+                # Only part of this chunk is written, so it will be read again next time
+                chunk_classifications = chunk_classifications[: int(remaining)]
+                new_classifications += chunk_classifications
+                new_marks += chunk_marks[: int(remaining)]
+                batch_offset = start_offset
+                limit_reached = True
+        if not limit_reached:
+            new_classifications += chunk_classifications
+            new_marks += chunk_marks
+            batch_offset = end_offset
+            max_classification_id = max(max_classification_id, chunk_max)
+            skipped_subject_ids.update(chunk_skipped)
+        pbar.update(len(chunk_classifications))
+        if limit_reached or len(new_classifications) >= BATCH_SIZE:
+            total += load(new_classifications, new_marks)
+            new_classifications = []
+            new_marks = []
+            written_offset = batch_offset
+            save_checkpoint()
+
+    if workers > 1:
+        # Don't share database connections with the worker processes
+        connections.close_all()
+        pool = Pool(workers, initializer=_init_parser, initargs=(parser,))
+    else:
+        pool = nullcontext()
+
+    with pool, tqdm(total=limit) as pbar:
+        # Chunks being parsed by the pool, in export order
+        parsing = deque()
+        rows = []
+        chunk_offset = export.offset
+
+        def submit(rows, start_offset, end_offset):
+            if workers > 1:
+                parsing.append(
+                    (pool.apply_async(_parse, (rows,)), start_offset, end_offset)
                 )
-            )
-            existing_subjects = dict(
-                ZooniverseSubject.objects.all().values_list("subject_id", "pk")
-            )
+                while len(parsing) > 2 * workers and not limit_reached:
+                    result, start_offset, end_offset = parsing.popleft()
+                    write(result.get(), start_offset, end_offset)
+            else:
+                write(parser(rows), start_offset, end_offset)
+
+        for attempt in range(5):
             try:
-                for c in get_classification_export():
-                    if limit is not None and total + len(new_classifications) >= limit:
+                # After a failure this carries on from the last row read, and the
+                # chunks still waiting to be parsed or written are kept
+                for c in export:
+                    rows.append(c)
+                    if len(rows) >= CHUNK_SIZE:
+                        submit(rows, chunk_offset, export.offset)
+                        rows = []
+                        chunk_offset = export.offset
+                    if limit_reached:
                         break
-                    classification_id = int(c["classification_id"])
-                    subject_id = int(c["subject_ids"])
-                    user_id = c["user_id"]
-                    if len(user_id) == 0:
-                        user_id = None
-                    else:
-                        user_id = int(user_id)
-
-                    if classification_id in existing_classifications:
-                        existing_classifications.remove(classification_id)
-                        continue
-
-                    if subject_id not in existing_subjects:
-                        if warn_missing_subjects:
-                            logger.warning(
-                                f"Skipping classification {classification_id} for unknown subject {subject_id}"
-                            )
-                        continue
-
-                    annotation = json.loads(c["annotations"])
-                    timestamp = date_parse(c["created_at"])
-
-                    new_classifications.append(
-                        ZooniverseClassification(
-                            classification_id=classification_id,
-                            subject_id=existing_subjects[subject_id],
-                            user_id=user_id,
-                            timestamp=timestamp,
-                            annotation=annotation,
-                        )
-                    )
-                    pbar.update(1)
-                    i += 1
-                    if i >= BATCH_SIZE:
-                        total += len(
-                            ZooniverseClassification.objects.bulk_create(
-                                new_classifications
-                            )
-                        )
-                        new_classifications = []
-                        i = 0
+                else:
+                    if len(rows) > 0:
+                        submit(rows, chunk_offset, export.offset)
+                    completed = True
             except requests.RequestException:
+                logger.warning(
+                    f"Classification export download failed at byte {export.offset}, retrying"
+                )
                 time.sleep(attempt * 60)
                 continue
             break
-    total += len(ZooniverseClassification.objects.bulk_create(new_classifications))
+
+        while len(parsing) > 0 and not limit_reached:
+            result, start_offset, end_offset = parsing.popleft()
+            write(result.get(), start_offset, end_offset)
+    total += load(new_classifications, new_marks)
+    written_offset = batch_offset
+
+    if completed and not limit_reached:
+        if full or max_classification_id > import_state.watermark:
+            import_state.watermark = max_classification_id
+        import_state.skipped_subject_ids = sorted(skipped_subject_ids)
+        import_state.export_sha256 = export.sha256
+        import_state.checkpoint = None
+        import_state.save()
+    else:
+        save_checkpoint()
+    return total
+
+
+def backfill_marks(loader=AUTO, batch_size=10000):
+    """
+    Creates the ZooniverseMarks for classifications which haven't had them extracted yet, such
+    as ones created outside of import_classifications. Returns the number of marks created.
+    """
+    mark_loader = get_loader(
+        ZooniverseMark,
+        ["classification_id", "task", "task_index", "mark_index", "tool", "x", "width"],
+        loader,
+    )
+    classifications = ZooniverseClassification.objects.filter(
+        marks_extracted=False
+    ).order_by("pk")
+    total = 0
+    last_pk = 0
+    with tqdm(total=classifications.count()) as pbar:
+        while True:
+            batch = list(
+                classifications.filter(pk__gt=last_pk).values_list(
+                    "pk", "classification_id", "annotation"
+                )[:batch_size]
+            )
+            if len(batch) == 0:
+                break
+            total += mark_loader.load(
+                [
+                    mark_loader.prepare(dict(mark, classification_id=classification_id))
+                    for _, classification_id, annotation in batch
+                    for mark in annotation_marks(annotation)
+                ]
+            )
+            ZooniverseClassification.objects.filter(
+                pk__in=[pk for pk, _, _ in batch]
+            ).update(marks_extracted=True)
+            last_pk = batch[-1][0]
+            pbar.update(len(batch))
     return total
 
 
@@ -121,10 +531,16 @@ def import_subjects(
     sequence=None,
     sequence_identifier=None,
     limit=None,
+    full=False,
+    export_path=None,
 ):
     """
     Downloads the latest subjects export and creates new ZooniverseSubject objects.
 
+    If the export hasn't changed since it was last completely imported, nothing is done
+    unless full is set. To import from a local copy of an export instead of the latest one,
+    give its export_path.
+
     Options:
         - target_identifier: The metadata key name which gives the target/object ID.
           Any subjects which don't have this metadata key will be skipped.
@@ -138,12 +554,131 @@ def import_subjects(
         - sequence_identifier: the metadata key name which gives the sequence name (i.e.
           the data release number, sector name, or other grouping).
     """
+    import_state, _ = ZooniverseImportState.objects.get_or_create(
+        export_type=ZooniverseImportState.SUBJECTS,
+        source_id=settings.ZOONIVERSE_PROJECT_ID,
+    )
+    export = get_subject_export(export_path)
+    if (
+        not full
+        and export.sha256 is not None
+        and export.sha256 == import_state.export_sha256
+    ):
+        logger.info("Subject export is unchanged since the last import")
+        return 0, 0
+
+    BATCH_SIZE = 5000
+
     if survey is not None:
         survey = ZooniverseSurvey.objects.get_or_create(name=survey)[0]
 
+    # Everything needed to decide what to do with each row is loaded up front, and rows are
+    # then written in batches, so the number of queries depends on the number of batches
+    # rather than the number of subjects
+    existing_subjects = {
+        subject_id: [pk, subject_set_id, retired_at]
+        for subject_id, pk, subject_set_id, retired_at in ZooniverseSubject.objects.values_list(
+            "subject_id", "pk", "subject_set__subject_set_id", "retired_at"
+        ).iterator(
+            chunk_size=10000
+        )
+    }
+    subject_sets = dict(
+        ZooniverseSubjectSet.objects.values_list("subject_set_id", "pk")
+    )
+    targets = {
+        (survey_id, identifier): pk
+        for pk, survey_id, identifier in ZooniverseTarget.objects.values_list(
+            "pk", "survey_id", "identifier"
+        ).iterator(chunk_size=10000)
+    }
+
+    # Keyed by subject ID, since the same subject can appear in more than one row
+    new_subjects = {}
+    updated_subjects = {}
+
+    def write_batch():
+        nonlocal new_subjects, updated_subjects
+        new_subject_sets = {
+            subject["subject_set_id"]
+            for subject in list(new_subjects.values()) + list(updated_subjects.values())
+        } - subject_sets.keys()
+        if len(new_subject_sets) > 0:
+            ZooniverseSubjectSet.objects.bulk_create(
+                [ZooniverseSubjectSet(subject_set_id=i) for i in new_subject_sets]
+            )
+            subject_sets.update(
+                ZooniverseSubjectSet.objects.filter(
+                    subject_set_id__in=new_subject_sets
+                ).values_list("subject_set_id", "pk")
+            )
+
+        new_targets = {
+            subject["target"]
+            for subject in new_subjects.values()
+            if subject["target"] not in targets
+        }
+        if len(new_targets) > 0:
+            ZooniverseTarget.objects.bulk_create(
+                [
+                    ZooniverseTarget(survey_id=survey_id, identifier=identifier)
+                    for survey_id, identifier in new_targets
+                ]
+            )
+            for survey_id in {survey_id for survey_id, _ in new_targets}:
+                targets.update(
+                    {
+                        (survey_id, identifier): pk
+                        for pk, identifier in ZooniverseTarget.objects.filter(
+                            survey_id=survey_id,
+                            identifier__in=[
+                                i for s, i in new_targets if s == survey_id
+                            ],
+                        ).values_list("pk", "identifier")
+                    }
+                )
+
+        if len(new_subjects) > 0:
+            ZooniverseSubject.objects.bulk_create(
+                [
+                    ZooniverseSubject(
+                        subject_id=subject_id,
+                        subject_set_id=subject_sets[subject["subject_set_id"]],
+                        metadata=subject["metadata"],
+                        retired_at=subject["retired_at"],
+                        data_url=subject["data_url"],
+                        target_id=targets[subject["target"]],
+                        sequence=subject["sequence"],
+                    )
+                    for subject_id, subject in new_subjects.items()
+                ]
+            )
+            for subject_id, pk in ZooniverseSubject.objects.filter(
+                subject_id__in=new_subjects.keys()
+            ).values_list("subject_id", "pk"):
+                existing_subjects[subject_id][0] = pk
+
+        if len(updated_subjects) > 0:
+            now = timezone.now()
+            ZooniverseSubject.objects.bulk_update(
+                [
+                    ZooniverseSubject(
+                        pk=existing_subjects[subject_id][0],
+                        subject_set_id=subject_sets[subject["subject_set_id"]],
+                        retired_at=subject["retired_at"],
+                        updated=now,
+                    )
+                    for subject_id, subject in updated_subjects.items()
+                ],
+                ["subject_set", "retired_at", "updated"],
+            )
+        new_subjects = {}
+        updated_subjects = {}
+
     created_count = 0
     updated_count = 0
-    for s in tqdm(get_subject_export(), total=limit):
+    completed = False
+    for s in tqdm(export, total=limit):
         if limit is not None and created_count > limit:
             break
         subject_id = int(s["subject_id"])
@@ -161,66 +696,70 @@ def import_subjects(
             retired_at = None
 
         subject_set_id = int(s["subject_set_id"])
-        subject_set, _ = ZooniverseSubjectSet.objects.get_or_create(
-            subject_set_id=subject_set_id
-        )
 
-        try:
-            s = ZooniverseSubject.objects.get(subject_id=subject_id)
-            changed = False
-            if s.subject_set != subject_set:
-                s.subject_set = subject_set
-                changed = True
-            if s.retired_at != retired_at:
-                s.retired_at = retired_at
-                changed = True
-            if changed:
-                s.save()
-                updated_count += 1
-            continue
-        except ZooniverseSubject.DoesNotExist:
-            pass
-
-        locations = json.loads(s["locations"])
-        metadata = json.loads(s["metadata"])
+        if subject_id in existing_subjects:
+            existing = existing_subjects[subject_id]
+            if existing[1] != subject_set_id or existing[2] != retired_at:
+                existing[1] = subject_set_id
+                existing[2] = retired_at
+                if subject_id in new_subjects:
+                    new_subjects[subject_id]["subject_set_id"] = subject_set_id
+                    new_subjects[subject_id]["retired_at"] = retired_at
+                else:
+                    updated_subjects[subject_id] = {
+                        "subject_set_id": subject_set_id,
+                        "retired_at": retired_at,
+                    }
+                    updated_count += 1
+        else:
+            locations = json.loads(s["locations"])
+            metadata = json.loads(s["metadata"])
 
-        if survey_identifier is not None:
-            survey_name = metadata.get(survey_identifier, None)
-            if survey_name is None:
-                continue
-            if survey is None:
-                survey = ZooniverseSurvey.objects.get_or_create(name=survey_name)[0]
-            else:
-                if survey.name != survey_name:
+            if survey_identifier is not None:
+                survey_name = metadata.get(survey_identifier, None)
+                if survey_name is None:
                     continue
+                if survey is None:
+                    survey = ZooniverseSurvey.objects.get_or_create(name=survey_name)[0]
+                else:
+                    if survey.name != survey_name:
+                        continue
 
-        target = None
-        if target_identifier is not None:
-            target_name = metadata.get(target_identifier, None)
-            if target_name is None:
+            target = None
+            if target_identifier is not None:
+                target_name = metadata.get(target_identifier, None)
+                if target_name is None:
+                    continue
+                target = (survey.pk, target_name)
+            if target is None:
                 continue
-            target = ZooniverseTarget.objects.get_or_create(
-                survey=survey, identifier=target_name
-            )[0]
-        if target is None:
-            continue
 
-        sequence_name = None
-        if sequence_identifier is not None:
-            sequence_name = metadata.get(sequence_identifier, None)
-            if sequence_name is None:
-                continue
-            if sequence is not None and sequence != sequence_name:
-                continue
+            sequence_name = None
+            if sequence_identifier is not None:
+                sequence_name = metadata.get(sequence_identifier, None)
+                if sequence_name is None:
+                    continue
+                if sequence is not None and sequence != sequence_name:
+                    continue
 
-        ZooniverseSubject.objects.create(
-            subject_id=subject_id,
-            subject_set=subject_set,
-            metadata=s["metadata"],
-            retired_at=retired_at,
-            data_url=locations["0"],
-            target=target,
-            sequence=sequence_name,
-        )
-        created_count += 1
+            new_subjects[subject_id] = {
+                "subject_set_id": subject_set_id,
+                "metadata": s["metadata"],
+                "retired_at": retired_at,
+                "data_url": locations["0"],
+                "target": target,
+                "sequence": sequence_name,
+            }
+            existing_subjects[subject_id] = [None, subject_set_id, retired_at]
+            created_count += 1
+
+        if len(new_subjects) + len(updated_subjects) >= BATCH_SIZE:
+            write_batch()
+    else:
+        completed = True
+    write_batch()
+
+    if completed:
+        import_state.export_sha256 = export.sha256
+        import_state.save()
     return created_count, updated_count
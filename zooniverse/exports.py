@@ -0,0 +1,238 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+import requests
+import time
+
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2**20
+
+# Seconds to wait for the export server to respond, or between chunks of a download
+TIMEOUT = 60
+
+
+def export_url(exportable, export_type):
+    """
+    Returns the download URL of the latest export of the given type for a Panoptes project or
+    workflow. A new URL is issued each time an export is generated, so this also identifies the
+    export.
+    """
+    return exportable.describe_export(export_type)["media"][0]["src"]
+
+
+def get_export(exportable, export_type):
+    """
+    Returns an ExportReader for the latest export of the given type. If
+    ZOONIVERSE_EXPORT_CACHE_DIR is set, this reads from a local copy of the export, which is
+    only downloaded if the export has changed.
+    """
+    if settings.ZOONIVERSE_EXPORT_CACHE_DIR is None:
+        return ExportReader(export_url(exportable, export_type))
+    return cached_export(exportable, export_type, settings.ZOONIVERSE_EXPORT_CACHE_DIR)
+
+
+def local_export(path):
+    """
+    Returns an ExportReader for an export file which has already been downloaded.
+    """
+    path = Path(path).resolve()
+    return ExportReader(path.as_uri(), path=path)
+
+
+def cached_export(exportable, export_type, cache_dir):
+    """
+    Makes sure the cache directory has an up to date copy of the latest export, and returns
+    an ExportReader for it.
+
+    Each export is stored alongside a JSON file recording where it was downloaded from, when
+    the export was generated, its ETag, size and SHA-256 hash. The export is downloaded again
+    only if it's been regenerated (and the server doesn't report it as unchanged), or if the
+    cached file doesn't match the recorded size. Interrupted downloads are resumed.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    media = exportable.describe_export(export_type)["media"][0]
+    name = f"{type(exportable).__name__.lower()}-{exportable.id}-{export_type}"
+    path = cache_dir / f"{name}.csv"
+    metadata_path = cache_dir / f"{name}.json"
+
+    metadata = _read_metadata(metadata_path)
+    if (
+        metadata is not None
+        and metadata["src"] == media["src"]
+        and metadata["updated_at"] == media["updated_at"]
+        and path.exists()
+        and path.stat().st_size == metadata["size"]
+    ):
+        logger.info(f"Using cached {export_type} export {path}")
+    else:
+        metadata = _download_export(media, path, metadata)
+        _write_metadata(metadata_path, metadata)
+    return ExportReader(media["src"], path=path, sha256=metadata["sha256"])
+
+
+def _read_metadata(metadata_path):
+    try:
+        with open(metadata_path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_metadata(metadata_path, metadata):
+    tmp_path = metadata_path.with_name(f"{metadata_path.name}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f)
+    os.replace(tmp_path, metadata_path)
+
+
+def _download_export(media, path, metadata):
+    """
+    Downloads an export to path and returns its metadata. A partial download left by an
+    earlier attempt for the same export is carried on from where it stopped.
+    """
+    part_path = path.with_name(f"{path.name}.part")
+    part_metadata_path = path.with_name(f"{path.name}.part.json")
+    part_metadata = {"src": media["src"], "updated_at": media["updated_at"]}
+    if _read_metadata(part_metadata_path) != part_metadata:
+        part_path.unlink(missing_ok=True)
+        _write_metadata(part_metadata_path, part_metadata)
+
+    headers = {}
+    if metadata is not None and metadata.get("etag") and path.exists():
+        headers["If-None-Match"] = metadata["etag"]
+
+    for attempt in range(5):
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        if offset > 0:
+            headers["Range"] = f"bytes={offset}-"
+        try:
+            response = requests.get(
+                media["src"], headers=headers, stream=True, timeout=TIMEOUT
+            )
+            if response.status_code == requests.codes.not_modified:
+                logger.info(f"Export {media['src']} is unchanged")
+                part_path.unlink(missing_ok=True)
+                part_metadata_path.unlink()
+                return dict(metadata, **part_metadata)
+            response.raise_for_status()
+            mode = "ab"
+            if offset > 0 and response.status_code != requests.codes.partial_content:
+                mode = "wb"
+            logger.info(f"Downloading {media['src']} from byte {offset}")
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+            etag = response.headers.get("ETag")
+        except requests.RequestException:
+            logger.warning(f"Download of {media['src']} failed, retrying")
+            time.sleep(attempt * 60)
+            continue
+        break
+    else:
+        raise requests.ConnectionError(f"Failed to download {media['src']}")
+
+    sha256 = hashlib.sha256()
+    with open(part_path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            sha256.update(chunk)
+    os.replace(part_path, path)
+    part_metadata_path.unlink()
+    return dict(
+        part_metadata,
+        etag=etag,
+        size=path.stat().st_size,
+        sha256=sha256.hexdigest(),
+    )
+
+
+class ExportReader(object):
+    """
+    Streams rows from a Zooniverse data export CSV as dicts, keeping track of the byte offset
+    just after the last row read so that reading can be resumed part way through.
+
+    Rows are read from the local file at path if one is given, otherwise from the export's
+    URL. Iterating again (e.g. after a dropped connection) carries on from the current offset,
+    using an HTTP range request rather than downloading the export again.
+    """
+
+    def __init__(self, url, offset=0, fieldnames=None, path=None, sha256=None):
+        self.url = url
+        self.offset = offset
+        self.fieldnames = fieldnames
+        self.path = path
+        self.sha256 = sha256
+
+    @property
+    def identifier(self):
+        """
+        Identifies the export's content, for checking a saved position still applies to it.
+        """
+        return self.sha256 or self.url
+
+    def __iter__(self):
+        # The offset only moves on once a whole row has been read, so a retry never starts
+        # part way through a quoted multi-line field
+        self._read_offset = self.offset
+        reader = csv.reader(self._lines())
+        if self.fieldnames is None:
+            self.fieldnames = next(reader)
+            self.offset = self._read_offset
+        for row in reader:
+            self.offset = self._read_offset
+            yield dict(zip(self.fieldnames, row))
+
+    def _chunks(self):
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                while chunk := f.read(CHUNK_SIZE):
+                    yield chunk
+            return
+
+        headers = {}
+        if self.offset > 0:
+            headers["Range"] = f"bytes={self.offset}-"
+        response = requests.get(self.url, headers=headers, stream=True, timeout=TIMEOUT)
+        response.raise_for_status()
+
+        skip = 0
+        if self.offset > 0 and response.status_code != requests.codes.partial_content:
+            logger.warning(
+                f"Range requests not supported for {self.url}, skipping {self.offset} bytes"
+            )
+            skip = self.offset
+
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            if skip > 0:
+                chunk, skip = chunk[skip:], max(skip - len(chunk), 0)
+            yield chunk
+
+    def _lines(self):
+        # Lines keep their terminators, so that csv.reader keeps the line breaks in quoted
+        # multi-line fields
+        remainder = b""
+        for chunk in self._chunks():
+            lines = (remainder + chunk).split(b"\n")
+            remainder = lines.pop()
+            for line in lines:
+                yield self._decode(line + b"\n")
+        if len(remainder) > 0:
+            yield self._decode(remainder)
+
+    def _decode(self, line):
+        # csv.reader may consume several lines for a quoted multi-line field, so this tracks
+        # how far it has read. Once a row is returned it points past that row.
+        at_start = self._read_offset == 0
+        self._read_offset += len(line)
+        line = line.decode("utf-8")
+        if at_start:
+            line = line.lstrip("\ufeff")
+        return line
@@ -1,11 +1,68 @@
+import numpy
+
+from astropy import units
+from astropy.io import fits
 from astropy.stats import sigma_clip
 from astropy.time import Time
+from astropy.utils.masked import Masked
+from lightkurve import LightCurve
+from lightkurve.utils import TessQualityFlags
 from matplotlib import pyplot
-
-import seaborn
+from matplotlib.collections import PolyCollection
 
 DEFAULT_SIGMA_CLIP = 4
 
+# Diameter of the points in light curve images, in points
+POINT_SIZE = 2
+
+# Units as written in SPOC light curve files which astropy doesn't recognise
+FITS_UNITS = {"e-/s": "electron/s"}
+
+
+def read_tess_lightcurve_columns(
+    filename, flux_column="pdcsap_flux", quality_bitmask="default"
+):
+    """
+    Reads just the time, flux and flux_err from a TESS SPOC light curve file, giving the same
+    values as lightkurve's read_tess_lightcurve.
+
+    The file is memory mapped and only the columns which are needed are read from the table,
+    rather than building a table of every column. Rows with no time and rows with poor
+    quality flags are removed, and NaN fluxes and errors are masked.
+    """
+    flux_column = flux_column.upper()
+    with fits.open(filename, memmap=True) as hdulist:
+        hdu = hdulist[1]
+        columns = {c.name.upper(): c for c in hdu.columns}
+        data = hdu.data
+        time = numpy.asarray(data["TIME"], dtype=numpy.float64)
+        flux = numpy.asarray(data[flux_column], dtype=numpy.float64)
+        flux_err = numpy.asarray(data[f"{flux_column}_ERR"], dtype=numpy.float64)
+        if "QUALITY" in columns:
+            quality = numpy.asarray(data["QUALITY"])
+        else:
+            quality = numpy.zeros(len(time), dtype=int)
+        timesys = hdu.header.get("TIMESYS", "tdb").lower()
+        flux_unit = columns[flux_column].unit
+        flux_err_unit = columns[f"{flux_column}_ERR"].unit
+
+    keep = ~numpy.isnan(time)
+    keep &= TessQualityFlags.create_quality_mask(
+        quality_array=quality, bitmask=quality_bitmask
+    )
+    flux_unit = FITS_UNITS.get(flux_unit, flux_unit) or ""
+    flux_err_unit = FITS_UNITS.get(flux_err_unit, flux_err_unit) or ""
+    return LightCurve(
+        time=Time(time[keep], format="btjd", scale=timesys),
+        flux=Masked(
+            units.Quantity(flux[keep], flux_unit), mask=numpy.isnan(flux[keep])
+        ),
+        flux_err=Masked(
+            units.Quantity(flux_err[keep], flux_err_unit),
+            mask=numpy.isnan(flux_err[keep]),
+        ),
+    )
+
 
 def generate_image(
     timeseries,
@@ -14,11 +71,23 @@ def generate_image(
     sigma=DEFAULT_SIGMA_CLIP,
     errorbars=True,
 ):
-    df = timeseries.to_pandas()
-    df["time_jd"] = timeseries["time"].jd
+    """
+    Plots a light curve, with the given (min, peak, max) time ranges highlighted.
 
+    Rather than drawing every error bar, each column of pixels is filled between the bottom
+    and top of the error bars in it, making a band. Points are only drawn individually where
+    they're sparse, and columns with enough points to look filled anyway are filled between
+    the lowest and highest of them. This takes about the same time however many points there
+    are.
+    """
+    time = timeseries["time"].jd
+    flux = _column_values(timeseries["flux"])
     if sigma is not None and sigma is not False:
-        df["flux"] = sigma_clip(df["flux"], sigma=sigma)
+        flux[sigma_clip(flux, sigma=sigma, masked=True).mask] = numpy.nan
+    if errorbars and "flux_err" in timeseries.colnames:
+        flux_err = _column_values(timeseries["flux_err"])
+    else:
+        flux_err = numpy.full(len(flux), numpy.nan)
 
     fig, ax = pyplot.subplots(figsize=figsize)
 
@@ -32,25 +101,134 @@ def generate_image(
                 xmax = Time(xmax, format="jd")
             pyplot.axvspan(xmin.jd, xmax.jd, color="green", alpha=0.2)
             pyplot.axvline(xpeak.jd, color="orange", alpha=0.2)
-    # Remove the original index before plotting to avoid ValueError from Pandas due to duplicate index
-    seaborn.scatterplot(
-        data=df.reset_index(),
-        x="time_jd",
-        y="flux",
-        ax=ax,
-        s=4,
+
+    ax.set_xlabel("time_jd")
+    ax.set_ylabel("flux")
+
+    keep = numpy.isfinite(time) & numpy.isfinite(flux)
+    if not keep.any():
+        return fig
+    time = time[keep]
+    flux = flux[keep]
+    flux_err = flux_err[keep]
+    has_err = numpy.isfinite(flux_err)
+    lower = numpy.where(has_err, flux - flux_err, flux)
+    upper = numpy.where(has_err, flux + flux_err, flux)
+
+    # Sets the axis limits (with the usual margins) before dividing the plot into columns
+    ax.update_datalim([(time.min(), lower.min()), (time.max(), upper.max())])
+    ax.autoscale_view()
+    xlim = ax.get_xlim()
+    ylim = ax.get_ylim()
+    window = ax.get_window_extent()
+    columns = max(int(round(window.width)), 1)
+    # Flux per pixel, and the radius of a point in flux
+    pixel_height = (ylim[1] - ylim[0]) / max(window.height, 1)
+    point_radius = POINT_SIZE / 2 * fig.dpi / 72 * pixel_height
+
+    # Columns with enough points to cover at least half of their extent are filled. Points
+    # spanning less than a point's diameter (including lone points) are always drawn, as a
+    # column would be narrower than they are
+    column = _pixel(time, xlim, columns)
+    point_min, point_max = _column_extents(column, flux, flux, columns)
+    spread = point_max - point_min
+    counts = numpy.bincount(column, minlength=columns)
+    dense = (spread > 2 * point_radius) & (counts * 2 * point_radius >= spread / 2)
+    _fill_columns(
+        ax,
+        numpy.where(dense, point_min - point_radius, numpy.nan),
+        numpy.where(dense, point_max + point_radius, numpy.nan),
+        xlim,
+        color="C0",
+        alpha=0.5,
+    )
+    sparse = ~dense[column]
+    # Stamped as markers, which is much quicker than drawing a collection of them
+    ax.plot(
+        time[sparse],
+        flux[sparse],
+        linestyle="none",
+        marker="o",
+        markersize=POINT_SIZE,
+        markeredgewidth=0,
+        color="C0",
         alpha=0.5,
     )
 
-    if errorbars:
-        ax.errorbar(
-            df["time_jd"],
-            df["flux"],
-            yerr=df["flux_err"],
-            ecolor="red",
-            ls="none",
+    if has_err.any():
+        # Over the points, as the error bars were drawn
+        _fill_columns(
+            ax,
+            *_column_extents(column[has_err], lower[has_err], upper[has_err], columns),
+            xlim,
+            color="red",
             alpha=0.2,
-            elinewidth=0.5,
         )
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
 
     return fig
+
+
+def _column_values(column):
+    """
+    Returns a column's values as a float array, with masked values as NaN.
+    """
+    values = numpy.array(getattr(column, "unmasked", column), dtype=numpy.float64)
+    values[numpy.asarray(getattr(column, "mask", False))] = numpy.nan
+    return values
+
+
+def _column_extents(column, y_min, y_max, columns):
+    """
+    Returns the lowest y_min and the highest y_max in each column, or NaN for columns
+    without any values.
+    """
+    column_min = numpy.full(columns, numpy.inf)
+    column_max = numpy.full(columns, -numpy.inf)
+    numpy.minimum.at(column_min, column, y_min)
+    numpy.maximum.at(column_max, column, y_max)
+    empty = numpy.isinf(column_min)
+    column_min[empty] = numpy.nan
+    column_max[empty] = numpy.nan
+    return column_min, column_max
+
+
+def _fill_columns(ax, column_min, column_max, xlim, **kwargs):
+    """
+    Fills equal width columns spanning xlim between column_min and column_max, leaving out
+    columns where they're NaN.
+    """
+    edges = numpy.linspace(xlim[0], xlim[1], len(column_min) + 1)
+    filled = ~numpy.isnan(column_min)
+    left = edges[:-1][filled]
+    right = edges[1:][filled]
+    bottom = column_min[filled]
+    top = column_max[filled]
+    # One rectangle per column, which is much quicker than fill_between's polygons
+    rectangles = numpy.stack(
+        [
+            numpy.column_stack([left, bottom]),
+            numpy.column_stack([left, top]),
+            numpy.column_stack([right, top]),
+            numpy.column_stack([right, bottom]),
+        ],
+        axis=1,
+    )
+    ax.add_collection(
+        PolyCollection(
+            rectangles,
+            linewidth=0,
+            # Smoothing the edges between columns only blurs them
+            antialiased=False,
+            # Above the highlights, like lines and markers
+            zorder=2,
+            **kwargs,
+        ),
+        autolim=False,
+    )
+
+
+def _pixel(values, limits, pixels):
+    scaled = (values - limits[0]) / (limits[1] - limits[0]) * pixels
+    return numpy.clip(scaled.astype(numpy.int64), 0, pixels - 1)
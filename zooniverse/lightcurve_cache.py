@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import os
+import requests
+import tempfile
+
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2**20
+
+# Seconds to wait to connect, or between bytes of a download, as astropy's remote_timeout
+# did when light curves were downloaded through it
+TIMEOUT = 10
+
+
+class LightcurveCache(object):
+    """
+    A size-limited local cache of light curve files, which can be shared by several processes.
+
+    Files are stored under objects/ named by the SHA-256 hash of their content, and each URL
+    maps to the hash of the file downloaded from it by a small file under urls/ named by the
+    hash of the URL. Identical files from different URLs are only stored once.
+
+    Every file is written to a temporary file and moved into place, so other processes never
+    see a partial file. Reading a file touches it, and once the total size goes over max_size
+    the least recently used files are deleted.
+
+    hits and misses count lookups made by this process.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def fetch(self, url, session=requests):
+        """
+        Returns the path of a local copy of the file at url, downloading it (with the given
+        requests session, if any) if it isn't cached.
+        """
+        path = self.get(url)
+        if path is not None:
+            self.hits += 1
+            logger.debug(f"Light curve cache hit for {url}")
+            return path
+        self.misses += 1
+        logger.debug(f"Light curve cache miss for {url}")
+        path = self.download(url, session)
+        self.evict()
+        return path
+
+    def get(self, url):
+        """
+        Returns the path of the cached copy of url, or None if it isn't cached.
+        """
+        try:
+            content_hash = self._url_path(url).read_text()
+        except FileNotFoundError:
+            return None
+        path = self._object_path(content_hash)
+        try:
+            # Marks the file as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def download(self, url, session=requests, timeout=TIMEOUT):
+        response = session.get(url, stream=True, timeout=timeout)
+        response.raise_for_status()
+        content_hash = hashlib.sha256()
+        with _temporary_file(self.directory / "objects") as (f, tmp_path):
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                content_hash.update(chunk)
+        path = self._object_path(content_hash.hexdigest())
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, path)
+
+        url_path = self._url_path(url)
+        with _temporary_file(url_path.parent, mode="w") as (f, tmp_path):
+            f.write(content_hash.hexdigest())
+        os.replace(tmp_path, url_path)
+        return path
+
+    def evict(self):
+        """
+        Deletes the least recently used files until the cache is within max_size. URLs which
+        map to deleted files are treated as not cached.
+        """
+        files = []
+        for path in (self.directory / "objects").glob("*/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        size = sum(f[1] for f in files)
+        for _, file_size, path in sorted(files):
+            if size <= self.max_size:
+                break
+            logger.debug(f"Evicting {path} from the light curve cache")
+            path.unlink(missing_ok=True)
+            size -= file_size
+
+    def _url_path(self, url):
+        url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return self.directory / "urls" / url_hash[:2] / url_hash
+
+    def _object_path(self, content_hash):
+        return self.directory / "objects" / content_hash[:2] / content_hash
+
+
+@contextmanager
+def _temporary_file(directory, mode="wb"):
+    """
+    Opens a new temporary file in directory, to be moved into place once it's written. It's
+    deleted if writing fails.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    # mkstemp only makes the file readable by its owner
+    os.chmod(path, 0o644)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f, path
+    except BaseException:
+        Path(path).unlink(missing_ok=True)
+        raise
+
+
+_cache = None
+
+
+def get_lightcurve_cache():
+    """
+    Returns the light curve cache configured by LIGHTCURVE_CACHE_DIR and
+    LIGHTCURVE_CACHE_SIZE, or None if it's disabled.
+    """
+    global _cache
+    if settings.LIGHTCURVE_CACHE_DIR is None:
+        return None
+    if _cache is None or _cache.directory != Path(settings.LIGHTCURVE_CACHE_DIR):
+        _cache = LightcurveCache(
+            settings.LIGHTCURVE_CACHE_DIR, settings.LIGHTCURVE_CACHE_SIZE
+        )
+    return _cache
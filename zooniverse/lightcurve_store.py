@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import numpy
+import os
+import tempfile
+
+from pathlib import Path
+
+from astropy import units
+from astropy.time import Time
+from astropy.timeseries import TimeSeries
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("jd1", "jd2", "flux", "flux_err")
+
+
+class LightcurveStore(object):
+    """
+    Preprocessed light curves, stored as plain float64 arrays so that they can be loaded
+    without parsing the original file.
+
+    Each light curve is a .npy file holding a 4 x N array: the two parts of the time as JD
+    (which together keep the full precision of the original times), flux and flux_err, with
+    masked fluxes stored as NaN. The time scale and units are kept in a JSON file alongside.
+    Arrays are memory mapped when loaded, so nothing is read until it's used.
+
+    Light curves are keyed by the fetch method and data URL, so a change to how a survey's
+    data are fetched doesn't pick up light curves preprocessed the old way.
+
+    As in the LightcurveCache, loading a light curve touches it, and evict() deletes the least
+    recently used light curves once the total size goes over max_size.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = Path(directory)
+        self.max_size = max_size
+
+    def load(self, fetch_data_method, data_uri):
+        """
+        Returns the stored light curve as a TimeSeries, or None if it isn't stored.
+        """
+        path = self._path(fetch_data_method, data_uri)
+        try:
+            with open(path.with_suffix(".json")) as f:
+                metadata = json.load(f)
+            data = numpy.load(path.with_suffix(".npy"), mmap_mode="r")
+            # Marks the light curve as recently used
+            os.utime(path.with_suffix(".npy"))
+        except (FileNotFoundError, ValueError):
+            return None
+        jd1, jd2, flux, flux_err = data
+        return TimeSeries(
+            time=Time(jd1, jd2, format="jd", scale=metadata["scale"]),
+            data={
+                "flux": units.Quantity(flux, metadata["flux_unit"], copy=False),
+                "flux_err": units.Quantity(
+                    flux_err, metadata["flux_err_unit"], copy=False
+                ),
+            },
+            copy=False,
+        )
+
+    def save(self, fetch_data_method, data_uri, timeseries):
+        time = timeseries["time"]
+        data = numpy.empty((len(COLUMNS), len(timeseries)), dtype=numpy.float64)
+        data[0] = time.jd1
+        data[1] = time.jd2
+        metadata = {"data_uri": data_uri, "scale": time.scale}
+        for i, name in enumerate(COLUMNS[2:], 2):
+            if name in timeseries.colnames:
+                column = timeseries[name]
+                data[i] = getattr(column, "unmasked", column).value
+                data[i][numpy.asarray(getattr(column, "mask", False))] = numpy.nan
+                metadata[f"{name}_unit"] = str(column.unit)
+            else:
+                data[i] = numpy.nan
+                metadata[f"{name}_unit"] = ""
+
+        path = self._path(fetch_data_method, data_uri)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # The metadata is written first, so the light curve only appears once it's complete
+        for suffix, write in (
+            (".json", lambda f: f.write(json.dumps(metadata).encode("utf-8"))),
+            (".npy", lambda f: numpy.save(f, data)),
+        ):
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    write(f)
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, path.with_suffix(suffix))
+            except BaseException:
+                Path(tmp_path).unlink(missing_ok=True)
+                raise
+
+    def evict(self):
+        """
+        Deletes the least recently used light curves until the store is within max_size.
+        """
+        light_curves = []
+        for path in self.directory.glob("*/*.npy"):
+            try:
+                stat = path.stat()
+                size = stat.st_size + path.with_suffix(".json").stat().st_size
+            except FileNotFoundError:
+                continue
+            light_curves.append((stat.st_mtime, size, path))
+        size = sum(lc[1] for lc in light_curves)
+        for _, light_curve_size, path in sorted(light_curves):
+            if size <= self.max_size:
+                break
+            logger.debug(f"Evicting {path} from the light curve store")
+            # The array is deleted first, so the light curve disappears before it's incomplete
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+            size -= light_curve_size
+
+    def __contains__(self, key):
+        fetch_data_method, data_uri = key
+        return self._path(fetch_data_method, data_uri).with_suffix(".npy").exists()
+
+    def _path(self, fetch_data_method, data_uri):
+        key = hashlib.sha256(
+            f"{fetch_data_method}:{data_uri}".encode("utf-8")
+        ).hexdigest()
+        return self.directory / key[:2] / key
+
+
+_store = None
+
+
+def get_lightcurve_store():
+    """
+    Returns the light curve store configured by LIGHTCURVE_STORE_DIR and
+    LIGHTCURVE_STORE_SIZE, or None if it's disabled.
+    """
+    global _store
+    if settings.LIGHTCURVE_STORE_DIR is None:
+        return None
+    if _store is None or _store.directory != Path(settings.LIGHTCURVE_STORE_DIR):
+        _store = LightcurveStore(
+            settings.LIGHTCURVE_STORE_DIR, settings.LIGHTCURVE_STORE_SIZE
+        )
+    return _store
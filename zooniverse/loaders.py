@@ -0,0 +1,154 @@
+import csv
+import io
+import json
+
+from dateutil.parser import parse as date_parse
+
+from django.db import connection, models, transaction
+
+AUTO = "auto"
+COPY = "copy"
+ORM = "orm"
+LOADER_CHOICES = (AUTO, COPY, ORM)
+
+
+class BulkCreateLoader(object):
+    """
+    Writes rows to the database with the ORM's bulk_create. Works on any database.
+
+    Rows are dicts of field name to the value as it appears in the export, i.e. JSON fields
+    and dates are still strings. prepare() parses them into Python values.
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.json_fields = set()
+        self.datetime_fields = set()
+        for name in fields:
+            field = model._meta.get_field(name)
+            if isinstance(field, models.JSONField):
+                self.json_fields.add(name)
+            elif isinstance(field, models.DateTimeField):
+                self.datetime_fields.add(name)
+
+    def prepare(self, row):
+        for name in self.json_fields:
+            row[name] = json.loads(row[name])
+        for name in self.datetime_fields:
+            if row[name] is not None:
+                row[name] = date_parse(row[name])
+        return row
+
+    def value(self, row, name):
+        """
+        Returns the value of a field from a prepared row.
+        """
+        return row[name]
+
+    def json_value(self, row, name):
+        """
+        Returns the decoded value of a JSON field from a prepared row.
+        """
+        return row[name]
+
+    def load(self, rows, returning=None):
+        """
+        Inserts the prepared rows, returning the number created, or if returning is the name
+        of one of the fields, a list of its value in each row which was created.
+        """
+        created = self.model.objects.bulk_create([self.model(**row) for row in rows])
+        if returning is not None:
+            return [getattr(obj, returning) for obj in created]
+        return len(created)
+
+
+class CopyLoader(BulkCreateLoader):
+    """
+    Writes rows to PostgreSQL by streaming them into a temporary staging table with
+    COPY FROM STDIN and then merging them into the model's table, skipping any which
+    conflict with existing rows.
+
+    JSON and dates are left as strings for PostgreSQL to parse, so no model instances or
+    decoded annotations are built in Python.
+    """
+
+    def __init__(self, model, fields):
+        super().__init__(model, fields)
+        self.columns = [model._meta.get_field(name).column for name in fields]
+        self.timestamp_columns = [
+            f.column
+            for f in model._meta.concrete_fields
+            if (getattr(f, "auto_now", False) or getattr(f, "auto_now_add", False))
+            and f.name not in fields
+        ]
+
+    def prepare(self, row):
+        return tuple(row[name] for name in self.fields)
+
+    def value(self, row, name):
+        return row[self.fields.index(name)]
+
+    def json_value(self, row, name):
+        return json.loads(self.value(row, name))
+
+    def load(self, rows, returning=None):
+        if len(rows) == 0:
+            return [] if returning is not None else 0
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        staging = connection.ops.quote_name(f"{self.model._meta.db_table}_staging")
+        columns = ", ".join(connection.ops.quote_name(c) for c in self.columns)
+        timestamp_columns = "".join(
+            f", {connection.ops.quote_name(c)}" for c in self.timestamp_columns
+        )
+        timestamp_values = ", now()" * len(self.timestamp_columns)
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS "
+                f"SELECT {columns} FROM {table} WITH NO DATA"
+            )
+            copy_sql = f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)"
+            if hasattr(cursor.cursor, "copy_expert"):
+                # psycopg2
+                cursor.cursor.copy_expert(copy_sql, buffer)
+            else:
+                # psycopg 3
+                with cursor.cursor.copy(copy_sql) as copy:
+                    copy.write(buffer.getvalue())
+            insert_sql = (
+                f"INSERT INTO {table} ({columns}{timestamp_columns}) "
+                f"SELECT {columns}{timestamp_values} FROM {staging} "
+                "ON CONFLICT DO NOTHING"
+            )
+            if returning is not None:
+                column = self.model._meta.get_field(returning).column
+                cursor.execute(
+                    f"{insert_sql} RETURNING {connection.ops.quote_name(column)}"
+                )
+                created = [value for (value,) in cursor.fetchall()]
+            else:
+                cursor.execute(insert_sql)
+                created = cursor.rowcount
+            # Dropped now rather than on commit, in case this is within a larger transaction
+            # which loads more rows
+            cursor.execute(f"DROP TABLE {staging}")
+            return created
+
+
+def get_loader(model, fields, loader=AUTO):
+    """
+    Returns a loader for writing rows of the given fields to the model's table. The COPY
+    loader is used by default when the database is PostgreSQL.
+    """
+    if loader == AUTO:
+        loader = COPY if connection.vendor == "postgresql" else ORM
+    if loader == COPY:
+        if connection.vendor != "postgresql":
+            raise ValueError("The COPY loader requires PostgreSQL")
+        return CopyLoader(model, fields)
+    return BulkCreateLoader(model, fields)
@@ -1,21 +1,116 @@
-from django.core.management.base import BaseCommand
+import time
+
+from collections import deque
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 
 from tqdm import tqdm
 
-from zooniverse.aggregation import PeakGrouperTargetAggregator
-from zooniverse.models import ZooniverseTarget, ZooniverseTargetReduction
+from zooniverse.aggregation import aggregate_target
+from zooniverse.models import (
+    ZooniverseAggregationQueueEntry,
+    ZooniverseClassification,
+    ZooniverseTarget,
+)
+from zooniverse.tasks import aggregate_targets
 
 
 class Command(BaseCommand):
-    help = "Aggregates all unaggregated targets"
+    help = "Aggregates the targets in the aggregation queue, in order of priority"
 
-    def handle(self, *args, **options):
-        aggregated_targets = ZooniverseTargetReduction.objects.all().values_list(
-            "target_id", flat=True
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            help="Aggregate all unaggregated targets instead of the queued ones",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--update",
+            help="With --all, also fold new classifications into the existing reductions of aggregated targets",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--time-budget",
+            type=float,
+            default=None,
+            help="Stop starting on new targets after this many seconds",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes to aggregate targets with",
+        )
+        parser.add_argument(
+            "--enqueue",
+            help="Enqueue tasks for the task workers to aggregate the targets, rather than aggregating them here",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=100,
+            help="Number of targets per task (with --enqueue)",
         )
-        targets = ZooniverseTarget.objects.exclude(pk__in=aggregated_targets)
-        for target in tqdm(targets, total=targets.count()):
-            if target.generated_lightcurve_image:
-                target.generated_lightcurve_image.delete()
-            PeakGrouperTargetAggregator(target).save()
-            target.generate_lightcurve_image()
+
+    def handle(self, *args, **options):
+        # Reductions only include classifications' marks, and would skip over these for good
+        if ZooniverseClassification.objects.filter(marks_extracted=False).exists():
+            raise CommandError(
+                "Some classifications don't have their marks extracted yet. Run backfill_marks first."
+            )
+
+        if options["all"]:
+            targets = ZooniverseTarget.objects.all()
+            if not options["update"]:
+                targets = targets.filter(latest_reduction__isnull=True)
+            target_ids = list(targets.values_list("pk", flat=True))
+            update = options["update"]
+        else:
+            target_ids = list(
+                ZooniverseAggregationQueueEntry.objects.order_by(
+                    "-priority", "created"
+                ).values_list("target_id", flat=True)
+            )
+            update = True
+
+        if options["enqueue"]:
+            chunk_size = options["chunk_size"]
+            for i in range(0, len(target_ids), chunk_size):
+                aggregate_targets.enqueue(target_ids[i : i + chunk_size], update=update)
+            return
+
+        if options["time_budget"] is None:
+            deadline = None
+        else:
+            deadline = time.monotonic() + options["time_budget"]
+
+        def in_budget():
+            return deadline is None or time.monotonic() < deadline
+
+        if options["workers"] > 1:
+            # Don't share database connections with the worker processes
+            connections.close_all()
+            with Pool(options["workers"]) as pool, tqdm(total=len(target_ids)) as pbar:
+                # Only a few targets are handed to the pool ahead of time, so that it stops
+                # soon after the time budget runs out
+                aggregating = deque()
+                for target_id in target_ids:
+                    if not in_budget():
+                        break
+                    aggregating.append(
+                        pool.apply_async(aggregate_target, (target_id, update))
+                    )
+                    if len(aggregating) > 2 * options["workers"]:
+                        aggregating.popleft().get()
+                        pbar.update()
+                while len(aggregating) > 0:
+                    aggregating.popleft().get()
+                    pbar.update()
+        else:
+            for target_id in tqdm(target_ids):
+                if not in_budget():
+                    break
+                aggregate_target(target_id, update)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from zooniverse.data_import import backfill_marks
+from zooniverse.loaders import AUTO, LOADER_CHOICES
+
+
+class Command(BaseCommand):
+    help = "Extracts the marks from the annotations of classifications which don't have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loader",
+            choices=LOADER_CHOICES,
+            default=AUTO,
+            help="How to write marks to the database (default: copy on PostgreSQL, otherwise orm)",
+        )
+
+    def handle(self, *args, **options):
+        created = backfill_marks(loader=options["loader"])
+        print(f"Created {created} marks")
@@ -0,0 +1,84 @@
+import numpy
+import time
+
+from django.core.management.base import BaseCommand
+
+from zooniverse.data_import import ClassificationIdIndex
+from zooniverse.models import ZooniverseClassification
+
+
+class Command(BaseCommand):
+    help = "Measures how many export rows per second can be checked against the classifications which have already been imported"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--existing",
+            type=int,
+            default=5000000,
+            help="Number of existing classification IDs to generate (default: 5000000)",
+        )
+        parser.add_argument(
+            "--lookups",
+            type=int,
+            default=1000000,
+            help="Number of export rows to check",
+        )
+        parser.add_argument(
+            "--database",
+            help="Check against the classifications in the database instead of generated IDs",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--compare-list",
+            type=int,
+            default=0,
+            help="Also check this many rows against a Python list of the IDs, as imports used to",
+        )
+
+    def handle(self, *args, **options):
+        rng = numpy.random.default_rng(0)
+
+        start = time.perf_counter()
+        if options["database"]:
+            index = ClassificationIdIndex.from_queryset(
+                ZooniverseClassification.objects.all()
+            )
+        else:
+            # Classification IDs are increasing but not contiguous
+            ids = numpy.cumsum(rng.integers(1, 10, options["existing"]))
+            rng.shuffle(ids)
+            index = ClassificationIdIndex(ids, count=len(ids))
+        print(
+            f"Built index of {len(index)} IDs in {time.perf_counter() - start:.2f}s "
+            f"({index.ids.nbytes / 2**20:.1f} MiB)"
+        )
+        if len(index) == 0:
+            return
+
+        # About half of the rows are already imported
+        n = options["lookups"]
+        lookups = numpy.concatenate(
+            [
+                rng.choice(index.ids, n // 2),
+                rng.integers(index.ids[0], index.ids[-1] + 1, n - n // 2),
+            ]
+        )
+        rng.shuffle(lookups)
+        lookups = [int(i) for i in lookups]
+
+        start = time.perf_counter()
+        found = sum(1 for i in lookups if i in index)
+        elapsed = time.perf_counter() - start
+        print(
+            f"Index: {len(lookups) / elapsed:,.0f} rows/s ({found} of {len(lookups)} already imported)"
+        )
+
+        if options["compare_list"] > 0:
+            existing = index.ids.tolist()
+            rows = lookups[: options["compare_list"]]
+            start = time.perf_counter()
+            found = sum(1 for i in rows if i in existing)
+            elapsed = time.perf_counter() - start
+            print(
+                f"List: {len(rows) / elapsed:,.0f} rows/s ({found} of {len(rows)} already imported)"
+            )
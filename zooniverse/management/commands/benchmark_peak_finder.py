@@ -0,0 +1,92 @@
+import numpy
+import time
+
+from astropy import units
+from astropy.time import Time
+from astropy.timeseries import TimeSeries
+from astropy.utils.masked import Masked
+
+from django.core.management.base import BaseCommand
+
+from zooniverse.aggregation import (
+    PeakFinder,
+    PeakGrouperTargetAggregator,
+    TargetAggregator,
+    TargetContext,
+)
+from zooniverse.models import ZooniverseTarget
+
+
+class Command(BaseCommand):
+    help = "Measures how many annotations per second can be grouped by their peaks, with PeakFinder and with group_between"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--annotations",
+            type=int,
+            default=5000,
+            help="Number of annotations to generate (default: 5000)",
+        )
+        parser.add_argument(
+            "--cadences",
+            type=int,
+            default=20000,
+            help="Number of rows in the generated light curve (default: 20000, about a TESS sector)",
+        )
+        parser.add_argument(
+            "--compare",
+            type=int,
+            default=1000,
+            help="Number of the annotations to also group one at a time with group_between (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        rng = numpy.random.default_rng(0)
+
+        # Two-minute cadence with a gap in the middle, in TDB like TESS light curves
+        n = options["cadences"]
+        times = 2459000.0 + numpy.arange(n) * 2 / 1440
+        times[n // 2 :] += 1
+        flux = rng.normal(100, 10, n)
+        mask = rng.random(n) < 0.05
+        timeseries = TimeSeries(
+            time=Time(times, format="jd", scale="tdb"),
+            data={"flux": Masked(units.Quantity(flux, "electron/s"), mask=mask)},
+        )
+
+        # The target isn't saved, as the light curve is given to the aggregator directly
+        target = ZooniverseTarget(identifier="benchmark")
+        context = TargetContext(target)
+        context.data = timeseries
+        aggregator = PeakGrouperTargetAggregator(target, context)
+
+        x_mid = rng.uniform(times[0], times[-1], options["annotations"])
+        width = rng.exponential(0.2, options["annotations"])
+        x_min = x_mid - width
+        x_max = x_mid + width
+
+        start = time.perf_counter()
+        finder = PeakFinder(timeseries)
+        print(f"Built PeakFinder for {n} rows in {time.perf_counter() - start:.3f}s")
+
+        start = time.perf_counter()
+        groups = finder.peaks_between(x_min, x_max)
+        elapsed = time.perf_counter() - start
+        print(
+            f"PeakFinder: {len(x_min) / elapsed:,.0f} annotations/s "
+            f"({len(x_min)} in {elapsed:.3f}s)"
+        )
+
+        compare = min(options["compare"], len(x_min))
+        if compare > 0:
+            start = time.perf_counter()
+            expected = TargetAggregator.groups_between(
+                aggregator, x_min[:compare], x_max[:compare]
+            )
+            elapsed = time.perf_counter() - start
+            print(
+                f"group_between: {compare / elapsed:,.0f} annotations/s "
+                f"({compare} in {elapsed:.3f}s)"
+            )
+            if not numpy.array_equal(groups[:compare], expected, equal_nan=True):
+                print("The results differ")
@@ -0,0 +1,72 @@
+import numpy
+
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from tqdm import tqdm
+
+from zooniverse.lightcurve_store import get_lightcurve_store
+from zooniverse.models import ZooniverseSubject, ZooniverseSurvey
+
+
+def store_lightcurve(args):
+    survey_pk, data_url = args
+    return ZooniverseSurvey.objects.get(pk=survey_pk).fetch_data(data_url) is not None
+
+
+class Command(BaseCommand):
+    help = "Adds the light curves of existing subjects to the light curve store"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=numpy.inf,
+            help="Limit the number of light curves added",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes to fetch light curves with",
+        )
+
+    def handle(self, *args, **options):
+        store = get_lightcurve_store()
+        if store is None:
+            print("The light curve store is disabled (LIGHTCURVE_STORE_DIR is None)")
+            return
+
+        subjects = (
+            ZooniverseSubject.objects.filter(
+                target__survey__fetch_data_method__isnull=False, data_url__isnull=False
+            )
+            .exclude(target__survey__fetch_data_method="")
+            .values_list(
+                "target__survey", "target__survey__fetch_data_method", "data_url"
+            )
+            .distinct()
+        )
+        to_store = []
+        for survey_pk, fetch_data_method, data_url in subjects.iterator():
+            if (fetch_data_method, data_url) in store:
+                continue
+            to_store.append((survey_pk, data_url))
+            if len(to_store) >= options["limit"]:
+                break
+
+        if options["workers"] > 1:
+            # Don't share database connections with the worker processes
+            connections.close_all()
+            with Pool(options["workers"]) as pool:
+                stored = sum(
+                    tqdm(
+                        pool.imap_unordered(store_lightcurve, to_store),
+                        total=len(to_store),
+                    )
+                )
+        else:
+            stored = sum(map(store_lightcurve, tqdm(to_store)))
+        print(f"Added {stored} light curves to the store")
@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from zooniverse.models import ZooniverseTarget, ZooniverseTargetReduction
+
+BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = "Deletes superseded target reductions, keeping each target's latest ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep",
+            type=int,
+            default=1,
+            help="Number of reductions to keep for each target, including the current one",
+        )
+        parser.add_argument(
+            "--older-than",
+            type=float,
+            default=0,
+            help="Only delete reductions created more than this many days ago",
+        )
+
+    def handle(self, *args, **options):
+        superseded = (
+            ZooniverseTargetReduction.objects.annotate(
+                newer=Window(
+                    RowNumber(),
+                    partition_by=[F("target")],
+                    order_by=[F("created").desc(), F("pk").desc()],
+                )
+            )
+            .filter(
+                newer__gt=options["keep"],
+                created__lt=timezone.now() - timedelta(days=options["older_than"]),
+            )
+            .values_list("pk", flat=True)
+        )
+        current = ZooniverseTarget.objects.filter(
+            latest_reduction__isnull=False
+        ).values_list("latest_reduction", flat=True)
+        pks = sorted(set(superseded) - set(current))
+
+        deleted = 0
+        for i in range(0, len(pks), BATCH_SIZE):
+            _, batch_deleted = ZooniverseTargetReduction.objects.filter(
+                pk__in=pks[i : i + BATCH_SIZE]
+            ).delete()
+            deleted += batch_deleted.get(ZooniverseTargetReduction._meta.label, 0)
+        print(f"Deleted {deleted} superseded reductions")
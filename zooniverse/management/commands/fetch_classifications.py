@@ -6,6 +6,7 @@ from zooniverse.data_import import (
     generate_classification_export,
     import_classifications,
 )
+from zooniverse.loaders import AUTO, LOADER_CHOICES
 
 
 class Command(BaseCommand):
@@ -23,9 +24,36 @@ class Command(BaseCommand):
             help="Generate a new classifications export and wait for it before importing",
             action="store_true",
         )
+        parser.add_argument(
+            "--full",
+            help="Check every row of the export instead of only those after the last import",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--loader",
+            choices=LOADER_CHOICES,
+            default=AUTO,
+            help="How to write classifications to the database (default: copy on PostgreSQL, otherwise orm)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes to parse the export with",
+        )
+        parser.add_argument(
+            "--export-file",
+            help="Import from a previously downloaded export file instead of the latest export",
+        )
 
     def handle(self, *args, **options):
         if options["generate"]:
             generate_classification_export(wait=True)
-        imported = import_classifications(limit=options["limit"])
+        imported = import_classifications(
+            limit=options["limit"],
+            full=options["full"],
+            loader=options["loader"],
+            workers=options["workers"],
+            export_path=options["export_file"],
+        )
         print(f"Imported {imported} classifications")
@@ -23,6 +23,15 @@ class Command(BaseCommand):
             help="Generate a new classifications export and wait for it before importing",
             action="store_true",
         )
+        parser.add_argument(
+            "--full",
+            help="Import the export even if it hasn't changed since the last import",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--export-file",
+            help="Import from a previously downloaded export file instead of the latest export",
+        )
 
     def handle(self, *args, **options):
         if options["generate"]:
@@ -31,6 +40,8 @@ class Command(BaseCommand):
             # TODO: Add target_identifier and sequence_identfier once existing subjects have these
             survey_identifier="survey_name",
             limit=options["limit"],
+            full=options["full"],
+            export_path=options["export_file"],
         )
         print(
             f"Imported {imported} classifications and updated {updated} classifications"
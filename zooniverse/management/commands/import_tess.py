@@ -3,12 +3,19 @@ import math
 import numpy
 import tarfile
 
+from collections import deque
+from contextlib import nullcontext
+from multiprocessing import Pool
+
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 from pathlib import Path
 from tqdm import tqdm
 
 from zooniverse.models import ZooniverseSurvey, ZooniverseTarget, ZooniverseSubject
 
+BATCH_SIZE = 10000
+
 
 def nan_filter(x):
     if isinstance(x, str) or isinstance(x, list):
@@ -18,6 +25,54 @@ def nan_filter(x):
     return x
 
 
+def parse_member(content):
+    """
+    Parses the contents of a JSON metadata file into a list of subject field dicts.
+    """
+    subjects = []
+    for subject_id, meta in json.loads(content).items():
+        del meta["survey_name"]
+        meta = {k: nan_filter(v) for k, v in meta.items()}
+        subjects.append(
+            {
+                "subject_id": int(subject_id),
+                "target": str(meta["target"]),
+                "sequence": meta.pop("sector"),
+                "data_url": meta.pop("data_url"),
+                "metadata": meta,
+            }
+        )
+    return subjects
+
+
+def json_members(tar, limit):
+    i = 0
+    for tar_member in tqdm(tar):
+        if not tar_member.name.endswith(".json"):
+            continue
+        if "/._" in tar_member.name:
+            # Skip resource forks
+            continue
+        yield tar.extractfile(tar_member).read()
+        i += 1
+        if i >= limit:
+            break
+
+
+def parse_in_pool(pool, members, workers):
+    """
+    Parses members in the pool, yielding the results in order. Only a few members are
+    read ahead of the results being used, to keep memory use bounded.
+    """
+    parsing = deque()
+    for content in members:
+        parsing.append(pool.apply_async(parse_member, (content,)))
+        if len(parsing) > 2 * workers:
+            yield parsing.popleft().get()
+    while len(parsing) > 0:
+        yield parsing.popleft().get()
+
+
 class Command(BaseCommand):
     help = "Imports TESS subjects from JSON metadata (for subjects created before SL-TOM existed)"
 
@@ -29,39 +84,77 @@ class Command(BaseCommand):
             default=numpy.inf,
             help="Limit the number of subjects imported",
         )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes to parse the JSON metadata files with",
+        )
 
     def handle(self, *args, **options):
         file_path = Path(options["file_path"])
         if not file_path.exists():
             raise CommandError(f'Metadata file {options["file_path"]} not found')
 
-        tess_survey, _ = ZooniverseSurvey.objects.get_or_create(name="TESS")
-
-        with tarfile.open(file_path, "r") as tar:
-            i = 0
-            for tar_member in tqdm(tar):
-                if not tar_member.name.endswith(".json"):
-                    continue
-                if "/._" in tar_member.name:
-                    # Skip resource forks
-                    continue
-
-                metadata = json.load(tar.extractfile(tar_member))
-
-                for subject_id, meta in metadata.items():
-                    del meta["survey_name"]
-                    meta = {k: nan_filter(v) for k, v in meta.items()}
-
-                    target, _ = ZooniverseTarget.objects.get_or_create(
-                        survey=tess_survey, identifier=meta["target"]
-                    )
-                    ZooniverseSubject.objects.get_or_create(
-                        subject_id=subject_id,
-                        target=target,
-                        sequence=meta.pop("sector"),
-                        data_url=meta.pop("data_url"),
-                        metadata=meta,
-                    )
-                i += 1
-                if i >= options["limit"]:
-                    break
+        self.tess_survey, _ = ZooniverseSurvey.objects.get_or_create(name="TESS")
+
+        if options["workers"] > 1:
+            # Don't share database connections with the worker processes
+            connections.close_all()
+            pool = Pool(options["workers"])
+        else:
+            pool = nullcontext()
+
+        with pool, tarfile.open(file_path, "r") as tar:
+            members = json_members(tar, options["limit"])
+            if options["workers"] > 1:
+                parsed_members = parse_in_pool(pool, members, options["workers"])
+            else:
+                parsed_members = map(parse_member, members)
+
+            subjects = []
+            for parsed in parsed_members:
+                subjects += parsed
+                if len(subjects) >= BATCH_SIZE:
+                    self.create_subjects(subjects)
+                    subjects = []
+            self.create_subjects(subjects)
+
+    def create_subjects(self, subjects):
+        """
+        Creates a batch of subjects, along with any targets which don't exist yet. Subjects
+        which have already been imported are left as they are.
+        """
+        identifiers = {s["target"] for s in subjects}
+        targets = dict(
+            ZooniverseTarget.objects.filter(
+                survey=self.tess_survey, identifier__in=identifiers
+            ).values_list("identifier", "pk")
+        )
+        new_targets = identifiers - targets.keys()
+        if len(new_targets) > 0:
+            ZooniverseTarget.objects.bulk_create(
+                [
+                    ZooniverseTarget(survey=self.tess_survey, identifier=identifier)
+                    for identifier in new_targets
+                ]
+            )
+            targets.update(
+                ZooniverseTarget.objects.filter(
+                    survey=self.tess_survey, identifier__in=new_targets
+                ).values_list("identifier", "pk")
+            )
+
+        ZooniverseSubject.objects.bulk_create(
+            [
+                ZooniverseSubject(
+                    subject_id=s["subject_id"],
+                    target_id=targets[s["target"]],
+                    sequence=s["sequence"],
+                    data_url=s["data_url"],
+                    metadata=s["metadata"],
+                )
+                for s in subjects
+            ],
+            ignore_conflicts=True,
+        )
@@ -0,0 +1,122 @@
+import logging
+import requests
+import threading
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from django.core.management.base import BaseCommand
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from tqdm import tqdm
+
+from zooniverse.lightcurve_cache import TIMEOUT, get_lightcurve_cache
+from zooniverse.lightcurve_store import get_lightcurve_store
+from zooniverse.models import ZooniverseAggregationQueueEntry, ZooniverseSubject
+
+logger = logging.getLogger(__name__)
+
+# Evict from the cache after this many downloads, rather than after each one
+EVICT_EVERY = 100
+
+
+class Command(BaseCommand):
+    help = "Downloads the light curves of queued targets into the light curve cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            help="Prefetch light curves for every subject instead of those of queued targets",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=16,
+            help="Number of concurrent downloads",
+        )
+        parser.add_argument(
+            "--per-host",
+            type=int,
+            default=4,
+            help="Number of concurrent downloads from any one host",
+        )
+        parser.add_argument(
+            "--retries",
+            type=int,
+            default=3,
+            help="Number of times to retry a failed download",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=TIMEOUT,
+            help=f"Seconds to wait for a server before retrying (default: {TIMEOUT})",
+        )
+
+    def handle(self, *args, **options):
+        cache = get_lightcurve_cache()
+        if cache is None:
+            print("The light curve cache is disabled (LIGHTCURVE_CACHE_DIR is None)")
+            return
+        store = get_lightcurve_store()
+
+        subjects = ZooniverseSubject.objects.filter(
+            data_url__isnull=False, target__survey__fetch_data_method__isnull=False
+        )
+        if not options["all"]:
+            subjects = subjects.filter(
+                target__in=ZooniverseAggregationQueueEntry.objects.values("target")
+            )
+        urls = []
+        for fetch_data_method, data_url in (
+            subjects.values_list("target__survey__fetch_data_method", "data_url")
+            .distinct()
+            .iterator()
+        ):
+            if urlparse(data_url).scheme not in ("http", "https"):
+                continue
+            if store is not None and (fetch_data_method, data_url) in store:
+                continue
+            if cache.get(data_url) is not None:
+                continue
+            urls.append(data_url)
+
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_maxsize=options["threads"],
+            max_retries=Retry(
+                total=options["retries"],
+                backoff_factor=1,
+                status_forcelist=[429, 500, 502, 503, 504],
+            ),
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        host_limits = defaultdict(lambda: threading.Semaphore(options["per_host"]))
+        for url in urls:
+            # Create the semaphores up front rather than from several threads
+            host_limits[urlparse(url).netloc]
+
+        def download(url):
+            with host_limits[urlparse(url).netloc]:
+                cache.download(url, session, timeout=options["timeout"])
+
+        downloaded = 0
+        failed = 0
+        with ThreadPoolExecutor(options["threads"]) as executor:
+            futures = {executor.submit(download, url): url for url in urls}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                try:
+                    future.result()
+                except (requests.RequestException, OSError) as e:
+                    logger.warning(f"Failed to download {futures[future]}: {e}")
+                    failed += 1
+                    continue
+                downloaded += 1
+                if downloaded % EVICT_EVERY == 0:
+                    cache.evict()
+        cache.evict()
+        print(f"Downloaded {downloaded} light curves ({failed} failed)")
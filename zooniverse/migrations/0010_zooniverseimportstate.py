@@ -0,0 +1,27 @@
+# Generated by Django 4.2.23 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zooniverse', '0009_alter_zooniversesubject_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ZooniverseImportState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('export_type', models.CharField(choices=[('subjects', 'Subjects'), ('classifications', 'Classifications')], max_length=20)),
+                ('source_id', models.BigIntegerField(help_text='Project or workflow ID')),
+                ('watermark', models.BigIntegerField(default=0, help_text='Every export row with an ID at or below this has been imported')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('export_type', 'source_id')},
+            },
+        ),
+    ]
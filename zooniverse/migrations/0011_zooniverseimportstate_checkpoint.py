@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 07:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zooniverse', '0010_zooniverseimportstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zooniverseimportstate',
+            name='checkpoint',
+            field=models.JSONField(blank=True, help_text='Position in a partially imported export, to resume from', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zooniverse', '0011_zooniverseimportstate_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zooniverseimportstate',
+            name='export_sha256',
+            field=models.CharField(blank=True, help_text='Hash of the last export to be completely imported', max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 08:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zooniverse', '0012_zooniverseimportstate_export_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zooniversetargetreduction',
+            name='state',
+            field=models.JSONField(blank=True, help_text='Grouped annotations and the last classification included, for updating the reduction', null=True),
+        ),
+    ]
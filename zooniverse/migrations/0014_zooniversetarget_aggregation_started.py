@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 08:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zooniverse', '0013_zooniversetargetreduction_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zooniversetarget',
+            name='aggregation_started',
+            field=models.DateTimeField(blank=True, help_text="When a worker claimed the target for aggregation, while it's being aggregated", null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.23 on 2026-10-18 08:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zooniverse', '0014_zooniversetarget_aggregation_started'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ZooniverseMark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=20)),
+                ('task_index', models.PositiveSmallIntegerField()),
+                ('mark_index', models.PositiveSmallIntegerField()),
+                ('tool', models.SmallIntegerField(blank=True, null=True)),
+                ('x', models.FloatField()),
+                ('width', models.FloatField()),
+                ('classification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='marks', to='zooniverse.zooniverseclassification', to_field='classification_id')),
+            ],
+            options={
+                'unique_together': {('classification', 'task_index', 'mark_index')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.23 on 2026-10-18 08:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zooniverse', '0015_zooniversemark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ZooniverseAggregationQueueEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.FloatField(db_index=True)),
+                ('new_classifications', models.PositiveIntegerField(default=0, help_text='Classifications imported since the target was queued')),
+                ('retired', models.BooleanField(default=False, help_text="Whether all of the target's subjects are retired")),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('target', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='aggregation_queue_entry', to='zooniverse.zooniversetarget')),
+            ],
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.23 on 2026-10-18 08:27
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def collapse_classifications(apps, schema_editor):
+    ZooniverseTargetReduction = apps.get_model("zooniverse", "ZooniverseTargetReduction")
+    Through = ZooniverseTargetReduction.classifications.through
+    provenance = (
+        Through.objects.values("zooniversetargetreduction_id")
+        .annotate(
+            last_classification=Max("zooniverseclassification_id"),
+            classification_count=Count("pk"),
+        )
+        .values_list(
+            "zooniversetargetreduction_id", "last_classification", "classification_count"
+        )
+    )
+    reductions = []
+    for pk, last_classification, classification_count in provenance.iterator():
+        reductions.append(
+            ZooniverseTargetReduction(
+                pk=pk,
+                last_classification=last_classification,
+                classification_count=classification_count,
+            )
+        )
+        if len(reductions) >= 10000:
+            ZooniverseTargetReduction.objects.bulk_update(
+                reductions, ["last_classification", "classification_count"]
+            )
+            reductions = []
+    ZooniverseTargetReduction.objects.bulk_update(
+        reductions, ["last_classification", "classification_count"]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zooniverse', '0016_zooniverseaggregationqueueentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zooniversetargetreduction',
+            name='classification_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of classifications included'),
+        ),
+        migrations.AddField(
+            model_name='zooniversetargetreduction',
+            name='last_classification',
+            field=models.BigIntegerField(blank=True, help_text='Primary key of the latest ZooniverseClassification included', null=True),
+        ),
+        migrations.RunPython(collapse_classifications, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='zooniversetargetreduction',
+            name='classifications',
+        ),
+        migrations.AlterField(
+            model_name='zooniversetargetreduction',
+            name='state',
+            field=models.JSONField(blank=True, help_text='Grouped annotations, for updating the reduction', null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.23 on 2026-10-18 08:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import OuterRef, Subquery
+
+
+def set_latest_reductions(apps, schema_editor):
+    ZooniverseTarget = apps.get_model("zooniverse", "ZooniverseTarget")
+    ZooniverseTargetReduction = apps.get_model("zooniverse", "ZooniverseTargetReduction")
+    ZooniverseTarget.objects.update(
+        latest_reduction=Subquery(
+            ZooniverseTargetReduction.objects.filter(target=OuterRef("pk"))
+            .order_by("-created")
+            .values("pk")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zooniverse', '0017_reduction_provenance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zooniversetarget',
+            name='latest_reduction',
+            field=models.ForeignKey(blank=True, help_text="The target's current reduction", null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='zooniverse.zooniversetargetreduction'),
+        ),
+        migrations.RunPython(set_latest_reductions, migrations.RunPython.noop),
+    ]
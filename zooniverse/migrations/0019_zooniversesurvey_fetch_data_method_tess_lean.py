@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 08:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zooniverse', '0018_zooniversetarget_latest_reduction'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='zooniversesurvey',
+            name='fetch_data_method',
+            field=models.CharField(blank=True, choices=[('TESS', 'TESS'), ('TESS_LEAN', 'TESS (time and flux only)')], max_length=10, null=True),
+        ),
+    ]
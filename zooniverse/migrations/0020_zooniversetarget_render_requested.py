@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zooniverse', '0019_zooniversesurvey_fetch_data_method_tess_lean'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zooniversetarget',
+            name='render_requested',
+            field=models.DateTimeField(blank=True, help_text="When rendering the light curve image was enqueued, until it's rendered", null=True),
+        ),
+    ]
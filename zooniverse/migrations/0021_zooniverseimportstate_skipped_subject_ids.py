@@ -0,0 +1,22 @@
+# Generated by Django 4.2.23 on 2026-10-18 09:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("zooniverse", "0020_zooniversetarget_render_requested"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="zooniverseimportstate",
+            name="skipped_subject_ids",
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                help_text="Subjects which hadn't been imported when their classifications were skipped",
+            ),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:40
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def annotation_marks(annotation):
+    # A copy of zooniverse.data_import.annotation_marks as it was when this migration was
+    # written
+    for task_index, task in enumerate(annotation):
+        if "task" not in task or not isinstance(task.get("value"), list):
+            continue
+        for mark_index, mark in enumerate(task["value"]):
+            if not isinstance(mark, dict) or "x" not in mark or "width" not in mark:
+                continue
+            yield {
+                "task": task["task"],
+                "task_index": task_index,
+                "mark_index": mark_index,
+                "tool": mark.get("tool"),
+                "x": mark["x"],
+                "width": mark["width"],
+            }
+
+
+def extract_marks(apps, schema_editor):
+    ZooniverseClassification = apps.get_model("zooniverse", "ZooniverseClassification")
+    ZooniverseMark = apps.get_model("zooniverse", "ZooniverseMark")
+
+    # Classifications imported since marks were introduced already have theirs
+    ZooniverseClassification.objects.filter(
+        Exists(
+            ZooniverseMark.objects.filter(classification_id=OuterRef("classification_id"))
+        )
+    ).update(marks_extracted=True)
+
+    classifications = ZooniverseClassification.objects.filter(
+        marks_extracted=False
+    ).order_by("pk")
+    last_pk = 0
+    while True:
+        batch = list(
+            classifications.filter(pk__gt=last_pk).values_list(
+                "pk", "classification_id", "annotation"
+            )[:10000]
+        )
+        if len(batch) == 0:
+            break
+        ZooniverseMark.objects.bulk_create(
+            [
+                ZooniverseMark(classification_id=classification_id, **mark)
+                for _, classification_id, annotation in batch
+                for mark in annotation_marks(annotation)
+            ],
+            ignore_conflicts=True,
+        )
+        ZooniverseClassification.objects.filter(
+            pk__in=[pk for pk, _, _ in batch]
+        ).update(marks_extracted=True)
+        last_pk = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("zooniverse", "0021_zooniverseimportstate_skipped_subject_ids"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="zooniverseclassification",
+            name="marks_extracted",
+            field=models.BooleanField(
+                db_index=True,
+                default=False,
+                help_text="Whether the annotation's ZooniverseMarks have been created",
+            ),
+        ),
+        migrations.RunPython(extract_marks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:10
+
+from django.db import migrations
+from django.db.models import Count, F, Q
+from django.db.models.functions import Coalesce
+
+# As ZooniverseAggregationQueueEntry.RETIRED_WEIGHT was when this migration was written
+RETIRED_WEIGHT = 2
+
+
+def seed_aggregation_queue(apps, schema_editor):
+    """
+    Queues the targets which were left for aggregate_targets --all to find before the queue
+    existed: those which have never been aggregated, and those whose latest reduction is
+    missing classifications.
+    """
+    ZooniverseAggregationQueueEntry = apps.get_model(
+        "zooniverse", "ZooniverseAggregationQueueEntry"
+    )
+    ZooniverseClassification = apps.get_model("zooniverse", "ZooniverseClassification")
+    ZooniverseSubject = apps.get_model("zooniverse", "ZooniverseSubject")
+    ZooniverseTarget = apps.get_model("zooniverse", "ZooniverseTarget")
+
+    counts = {
+        target_id: (total, new)
+        for target_id, total, new in ZooniverseClassification.objects.values(
+            "subject__target"
+        )
+        .annotate(
+            total=Count("pk"),
+            new=Count(
+                "pk",
+                filter=Q(
+                    pk__gt=Coalesce(
+                        F("subject__target__latest_reduction__last_classification"), 0
+                    )
+                ),
+            ),
+        )
+        .values_list("subject__target", "total", "new")
+    }
+    unaggregated = set(
+        ZooniverseTarget.objects.filter(latest_reduction__isnull=True).values_list(
+            "pk", flat=True
+        )
+    )
+    stale = {target_id for target_id, (_, new) in counts.items() if new > 0}
+    unretired = set(
+        ZooniverseSubject.objects.filter(retired_at__isnull=True).values_list(
+            "target", flat=True
+        )
+    )
+
+    entries = []
+    for target_id in unaggregated | stale:
+        total, new = counts.get(target_id, (0, 0))
+        retired = target_id not in unretired
+        # As ZooniverseAggregationQueueEntry.calculate_priority
+        priority = new / max(total - new, 1)
+        if retired:
+            priority *= RETIRED_WEIGHT
+        entries.append(
+            ZooniverseAggregationQueueEntry(
+                target_id=target_id,
+                priority=priority,
+                new_classifications=new,
+                retired=retired,
+            )
+        )
+    # Targets which have been queued since the queue was added are left as they are
+    ZooniverseAggregationQueueEntry.objects.bulk_create(
+        entries, batch_size=10000, ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("zooniverse", "0022_zooniverseclassification_marks_extracted"),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_aggregation_queue, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.23 on 2026-10-18 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("zooniverse", "0023_seed_aggregation_queue"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="zooniversetarget",
+            name="lightcurve_unavailable",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When rendering the light curve image last failed, e.g. because its data couldn't be loaded",
+                null=True,
+            ),
+        ),
+    ]
@@ -1,18 +1,29 @@
+import logging
+import requests
+
 from astropy import units
 
 from collections import Counter
+from datetime import timedelta
+from urllib.parse import urlparse
 
 from django.core.files.base import ContentFile
 from django.db import models
-from django.db.models import Count
+from django.db.models import Count, Exists, OuterRef, Q
+from django.db.models.functions import Coalesce
 from django.urls import reverse
+from django.utils import timezone
 
 from lightkurve.io.tess import read_tess_lightcurve
 
 from matplotlib import pyplot
 
 from zooniverse.client import project
-from zooniverse.lightcurve import generate_image
+from zooniverse.lightcurve import generate_image, read_tess_lightcurve_columns
+from zooniverse.lightcurve_cache import get_lightcurve_cache
+from zooniverse.lightcurve_store import get_lightcurve_store
+
+logger = logging.getLogger(__name__)
 
 
 def fetch_tess_data(data_uri):
@@ -20,16 +31,35 @@ def fetch_tess_data(data_uri):
         ts = read_tess_lightcurve(data_uri)
     except (FileNotFoundError, ValueError, TypeError):
         return None
+    return trim_tess_data(ts)
+
+
+def fetch_tess_data_lean(data_uri):
+    """
+    Like fetch_tess_data, but only reads the columns which are used.
+    """
+    try:
+        ts = read_tess_lightcurve_columns(data_uri)
+    except (FileNotFoundError, ValueError, TypeError, KeyError):
+        return None
+    return trim_tess_data(ts)
+
+
+def trim_tess_data(ts):
     # Trim the first few hours from the start as loads of SPOC light curves seem to start with spurious peaks
-    ts = ts[ts["time"] > ts["time"][0] + 3 * units.hour]
-    return ts
+    return ts[ts["time"] > ts["time"][0] + 3 * units.hour]
 
 
 class ZooniverseSurvey(models.Model):
     TESS = "TESS"
-    FETCH_DATA_CHOICES = ((TESS, "TESS"),)
+    TESS_LEAN = "TESS_LEAN"
+    FETCH_DATA_CHOICES = (
+        (TESS, "TESS"),
+        (TESS_LEAN, "TESS (time and flux only)"),
+    )
     FETCH_DATA_METHODS = {
         TESS: fetch_tess_data,
+        TESS_LEAN: fetch_tess_data_lean,
     }
 
     name = models.CharField(max_length=50)
@@ -45,9 +75,35 @@ class ZooniverseSurvey(models.Model):
         return self.name
 
     def fetch_data(self, data_uri):
+        """
+        Returns the light curve at data_uri as a TimeSeries, from the light curve store if
+        it's been preprocessed, otherwise by fetching it with the survey's fetch method (and
+        then adding it to the store).
+        """
         if not self.fetch_data_method:
             return None
-        return self.FETCH_DATA_METHODS[self.fetch_data_method](data_uri)
+        store = get_lightcurve_store()
+        if store is not None:
+            data = store.load(self.fetch_data_method, data_uri)
+            if data is not None:
+                return data
+
+        local_uri = data_uri
+        cache = get_lightcurve_cache()
+        if cache is not None and urlparse(data_uri or "").scheme in ("http", "https"):
+            try:
+                local_uri = str(cache.fetch(data_uri))
+            except (requests.RequestException, OSError):
+                logger.warning(f"Couldn't cache {data_uri}, reading it directly")
+        data = self.FETCH_DATA_METHODS[self.fetch_data_method](local_uri)
+
+        if data is not None and store is not None:
+            try:
+                store.save(self.fetch_data_method, data_uri, data)
+                store.evict()
+            except OSError:
+                logger.warning(f"Couldn't add {data_uri} to the light curve store")
+        return data
 
 
 def zooniversetarget_lightcurve_image_path(instance, filename):
@@ -62,17 +118,71 @@ class ZooniverseTarget(models.Model):
         null=True, upload_to=zooniversetarget_lightcurve_image_path
     )
 
+    latest_reduction = models.ForeignKey(
+        "ZooniverseTargetReduction",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        help_text="The target's current reduction",
+    )
+
+    aggregation_started = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When a worker claimed the target for aggregation, while it's being aggregated",
+    )
+    render_requested = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When rendering the light curve image was enqueued, until it's rendered",
+    )
+    lightcurve_unavailable = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When rendering the light curve image last failed, e.g. because its data couldn't be loaded",
+    )
+
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    # Claims older than this are assumed to belong to a worker which died
+    AGGREGATION_CLAIM_TIMEOUT = timedelta(hours=1)
+    # Images which still haven't been rendered this long after being requested are
+    # requested again
+    RENDER_REQUEST_TIMEOUT = timedelta(hours=1)
+
     def __str__(self):
         return f"{self.survey} {self.identifier}"
 
+    @classmethod
+    def claim_for_aggregation(cls, pk):
+        """
+        Marks the target as being aggregated, unless another worker already has it. Returns
+        the target if it was claimed, or None otherwise. The claim is made with a single
+        conditional UPDATE, so only one worker can succeed.
+        """
+        now = timezone.now()
+        claimed = (
+            cls.objects.filter(pk=pk)
+            .filter(
+                Q(aggregation_started__isnull=True)
+                | Q(aggregation_started__lt=now - cls.AGGREGATION_CLAIM_TIMEOUT)
+            )
+            .update(aggregation_started=now)
+        )
+        if claimed == 0:
+            return None
+        return cls.objects.get(pk=pk)
+
+    def release_aggregation_claim(self):
+        ZooniverseTarget.objects.filter(pk=self.pk).update(aggregation_started=None)
+        self.aggregation_started = None
+
     def aggregated_annotations(self):
-        tr = self.zooniversetargetreduction_set.order_by("-created").first()
-        if tr is None:
+        if self.latest_reduction is None:
             return None
-        return tr.reduced_annotations
+        return self.latest_reduction.reduced_annotations
 
     def annotations(self):
         return self.classifications().values_list("annotation", flat=True)
@@ -89,7 +199,11 @@ class ZooniverseTarget(models.Model):
     def fetch_data(self):
         return self.survey.fetch_data(self.data_url)
 
-    def generate_lightcurve_image(self):
+    def generate_lightcurve_image(self, data=None):
+        """
+        Renders the target's light curve with its aggregated annotations highlighted. The
+        light curve is fetched unless it's given as data.
+        """
         annotations = self.aggregated_annotations()
         if annotations and len(annotations) > 0:
             highlights = list(
@@ -97,8 +211,11 @@ class ZooniverseTarget(models.Model):
             )
         else:
             highlights = None
-        data = self.fetch_data()
         if data is None:
+            data = self.fetch_data()
+        if data is None:
+            self.lightcurve_unavailable = timezone.now()
+            self.save(update_fields=["lightcurve_unavailable"])
             return
         fig = generate_image(
             data,
@@ -108,8 +225,10 @@ class ZooniverseTarget(models.Model):
         try:
             fig.savefig(image_data)
         except:
-            pass
+            self.lightcurve_unavailable = timezone.now()
+            self.save(update_fields=["lightcurve_unavailable"])
         else:
+            self.lightcurve_unavailable = None
             self.generated_lightcurve_image.save(
                 "lightcurve.png", image_data, save=True
             )
@@ -121,12 +240,51 @@ class ZooniverseTarget(models.Model):
 
     @property
     def lightcurve_image(self):
-        if not self.generated_lightcurve_image:
-            self.generate_lightcurve_image()
+        """
+        Returns the target's light curve image, or None if it hasn't been rendered yet. In
+        that case a task is enqueued to render it, so that it's never rendered while handling
+        a request.
+        """
         if self.generated_lightcurve_image:
             return self.generated_lightcurve_image
+        self.request_lightcurve_image()
         return None
 
+    @property
+    def lightcurve_image_unavailable(self):
+        """
+        Whether the light curve image can't be rendered, either because the survey has no way
+        to fetch light curves or because the last attempt failed. The image is rendered again
+        if the target is re-aggregated.
+        """
+        return (
+            not self.survey.fetch_data_method or self.lightcurve_unavailable is not None
+        )
+
+    def request_lightcurve_image(self):
+        """
+        Enqueues a task to render the target's light curve image, unless one has been enqueued
+        within the last RENDER_REQUEST_TIMEOUT or the image is unavailable.
+        """
+        # Imported here because the tasks depend on this module
+        from zooniverse.tasks import render_lightcurve_image
+
+        if self.lightcurve_image_unavailable:
+            return
+
+        now = timezone.now()
+        requested = (
+            ZooniverseTarget.objects.filter(pk=self.pk)
+            .filter(
+                Q(render_requested__isnull=True)
+                | Q(render_requested__lt=now - self.RENDER_REQUEST_TIMEOUT)
+            )
+            .update(render_requested=now)
+        )
+        if requested > 0:
+            self.render_requested = now
+            render_lightcurve_image.enqueue(self.pk)
+
 
 class ZooniverseSubjectSet(models.Model):
     subject_set_id = models.IntegerField()
@@ -200,20 +358,215 @@ class ZooniverseClassification(models.Model):
     user_id = models.BigIntegerField(null=True, blank=True)
     timestamp = models.DateTimeField()
     annotation = models.JSONField()
+    marks_extracted = models.BooleanField(
+        default=False,
+        db_index=True,
+        help_text="Whether the annotation's ZooniverseMarks have been created",
+    )
 
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
 
+class ZooniverseMark(models.Model):
+    """
+    A marked interval from a classification's annotation, as typed columns so that it can be
+    queried without decoding the annotation JSON. The mark is
+    annotation[task_index]["value"][mark_index].
+    """
+
+    classification = models.ForeignKey(
+        ZooniverseClassification,
+        on_delete=models.CASCADE,
+        to_field="classification_id",
+        related_name="marks",
+    )
+
+    task = models.CharField(max_length=20)
+    task_index = models.PositiveSmallIntegerField()
+    mark_index = models.PositiveSmallIntegerField()
+    tool = models.SmallIntegerField(null=True, blank=True)
+    x = models.FloatField()
+    width = models.FloatField()
+
+    class Meta:
+        unique_together = ("classification", "task_index", "mark_index")
+
+
+class ZooniverseImportState(models.Model):
+    """
+    Tracks progress through a project or workflow's data exports between import runs.
+    """
+
+    SUBJECTS = "subjects"
+    CLASSIFICATIONS = "classifications"
+    EXPORT_TYPE_CHOICES = (
+        (SUBJECTS, "Subjects"),
+        (CLASSIFICATIONS, "Classifications"),
+    )
+
+    export_type = models.CharField(max_length=20, choices=EXPORT_TYPE_CHOICES)
+    source_id = models.BigIntegerField(help_text="Project or workflow ID")
+
+    watermark = models.BigIntegerField(
+        default=0,
+        help_text="Every export row with an ID at or below this has been imported",
+    )
+    checkpoint = models.JSONField(
+        null=True,
+        blank=True,
+        help_text="Position in a partially imported export, to resume from",
+    )
+    export_sha256 = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        help_text="Hash of the last export to be completely imported",
+    )
+    skipped_subject_ids = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Subjects which hadn't been imported when their classifications were skipped",
+    )
+
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("export_type", "source_id")
+
+
 class ZooniverseTargetReduction(models.Model):
     """
     Reduced classifications for targets.
     """
 
     target = models.ForeignKey(ZooniverseTarget, on_delete=models.CASCADE)
-    classifications = models.ManyToManyField(ZooniverseClassification)
+
+    # Every classification of the target up to last_classification is included
+    last_classification = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text="Primary key of the latest ZooniverseClassification included",
+    )
+    classification_count = models.PositiveIntegerField(
+        default=0, help_text="Number of classifications included"
+    )
 
     reduced_annotations = models.JSONField()
+    state = models.JSONField(
+        null=True,
+        blank=True,
+        help_text="Grouped annotations, for updating the reduction",
+    )
+
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def stale(cls):
+        """
+        Returns the reductions whose targets have had classifications imported since they
+        were last updated, in a single query.
+        """
+        return cls.objects.filter(
+            Exists(
+                ZooniverseClassification.objects.filter(
+                    subject__target=OuterRef("target"),
+                    pk__gt=Coalesce(OuterRef("last_classification"), 0),
+                )
+            )
+        )
+
+
+class ZooniverseAggregationQueueEntry(models.Model):
+    """
+    A target which needs aggregating, because classifications have been imported for it since
+    it was last aggregated. Targets are aggregated in order of priority (see
+    calculate_priority).
+    """
+
+    # Targets whose subjects are all retired won't get any more classifications, so their
+    # aggregations are final
+    RETIRED_WEIGHT = 2
+
+    target = models.OneToOneField(
+        ZooniverseTarget,
+        on_delete=models.CASCADE,
+        related_name="aggregation_queue_entry",
+    )
+
+    priority = models.FloatField(db_index=True)
+    new_classifications = models.PositiveIntegerField(
+        default=0, help_text="Classifications imported since the target was queued"
+    )
+    retired = models.BooleanField(
+        default=False, help_text="Whether all of the target's subjects are retired"
+    )
 
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def calculate_priority(cls, new_classifications, total_classifications, retired):
+        """
+        The growth in the target's classifications since it was last aggregated, so a target
+        which has never been aggregated comes first and a handful of new classifications for
+        a well classified target come last. Retired targets are weighted up.
+        """
+        growth = new_classifications / max(
+            total_classifications - new_classifications, 1
+        )
+        if retired:
+            return growth * cls.RETIRED_WEIGHT
+        return growth
+
+    @classmethod
+    def enqueue(cls, new_classifications):
+        """
+        Queues targets given a dict of target pk to the number of classifications just
+        imported for each, or updates their entries if they're already queued.
+        """
+        if len(new_classifications) == 0:
+            return
+        target_ids = list(new_classifications)
+        total_classifications = dict(
+            ZooniverseClassification.objects.filter(subject__target__in=target_ids)
+            .values("subject__target")
+            .annotate(count=Count("pk"))
+            .values_list("subject__target", "count")
+        )
+        unretired = set(
+            ZooniverseSubject.objects.filter(
+                target__in=target_ids, retired_at__isnull=True
+            ).values_list("target", flat=True)
+        )
+        entries = {e.target_id: e for e in cls.objects.filter(target__in=target_ids)}
+        new_entries = []
+        now = timezone.now()
+        for target_id, count in new_classifications.items():
+            entry = entries.get(target_id)
+            if entry is None:
+                entry = cls(target_id=target_id)
+                new_entries.append(entry)
+            entry.new_classifications += count
+            entry.retired = target_id not in unretired
+            entry.priority = cls.calculate_priority(
+                entry.new_classifications,
+                total_classifications.get(target_id, 0),
+                entry.retired,
+            )
+            # bulk_update doesn't set auto_now fields
+            entry.updated = now
+        cls.objects.bulk_create(new_entries)
+        cls.objects.bulk_update(
+            entries.values(), ["priority", "new_classifications", "retired", "updated"]
+        )
+
+    @classmethod
+    def dequeue(cls, target_id, aggregated_since):
+        """
+        Removes a target from the queue after it's been aggregated, unless more of its
+        classifications were queued after aggregated_since.
+        """
+        cls.objects.filter(target_id=target_id, updated__lte=aggregated_since).delete()
@@ -0,0 +1,27 @@
+from django_tasks import task
+
+from zooniverse.aggregation import aggregate_target
+from zooniverse.models import ZooniverseTarget
+
+
+@task()
+def aggregate_targets(target_ids, update=False):
+    """
+    Aggregates a chunk of targets (see aggregation.aggregate_target). Returns the number of
+    targets which were aggregated or updated.
+    """
+    return sum(aggregate_target(target_id, update=update) for target_id in target_ids)
+
+
+@task()
+def render_lightcurve_image(target_id):
+    """
+    Renders a target's light curve image if it doesn't have one. Returns True if it did.
+    Targets whose image can't be rendered are marked as unavailable rather than being
+    requested again.
+    """
+    target = ZooniverseTarget.objects.get(pk=target_id)
+    if not target.generated_lightcurve_image:
+        target.generate_lightcurve_image()
+    ZooniverseTarget.objects.filter(pk=target_id).update(render_requested=None)
+    return bool(target.generated_lightcurve_image)
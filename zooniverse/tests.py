@@ -1,3 +1,412 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import numpy
+import requests
+import socket
+import tempfile
+import threading
 
-# Create your tests here.
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import skipUnless
+
+from astropy import units
+from astropy.io import fits
+from astropy.time import Time
+from astropy.timeseries import TimeSeries
+from astropy.utils.masked import Masked
+
+from matplotlib import pyplot
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from zooniverse.aggregation import (
+    PeakGrouperTargetAggregator,
+    TargetAggregator,
+    TargetContext,
+)
+from zooniverse.data_import import import_classifications
+from zooniverse.exports import ExportReader
+from zooniverse.lightcurve import generate_image
+from zooniverse.lightcurve_cache import get_lightcurve_cache
+from zooniverse.loaders import COPY, get_loader
+from zooniverse.models import (
+    ZooniverseClassification,
+    ZooniverseImportState,
+    ZooniverseMark,
+    ZooniverseSubject,
+    ZooniverseSubjectSet,
+    ZooniverseSurvey,
+    ZooniverseTarget,
+)
+from zooniverse.tasks import render_lightcurve_image
+
+
+class ImportClassificationsTestCase(TestCase):
+    def setUp(self):
+        survey = ZooniverseSurvey.objects.create(name="TESS")
+        target = ZooniverseTarget.objects.create(survey=survey, identifier="1")
+        subject_set = ZooniverseSubjectSet.objects.create(subject_set_id=1)
+        ZooniverseSubject.objects.create(
+            subject_id=1000, target=target, subject_set=subject_set, metadata={}
+        )
+
+        self.export_dir = tempfile.TemporaryDirectory()
+        self.export_path = Path(self.export_dir.name) / "classifications.csv"
+        with open(self.export_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                [
+                    "classification_id",
+                    "subject_ids",
+                    "user_id",
+                    "created_at",
+                    "annotations",
+                ]
+            )
+            for classification_id in range(1, 21):
+                writer.writerow(
+                    [
+                        classification_id,
+                        1000,
+                        "",
+                        "2024-01-01 00:00:00 UTC",
+                        json.dumps(
+                            [{"task": "T0", "value": [{"x": 2459000.5, "width": 0.1}]}]
+                        ),
+                    ]
+                )
+
+    def tearDown(self):
+        self.export_dir.cleanup()
+
+    def test_resume_after_limit_within_first_chunk(self):
+        self.assertEqual(
+            import_classifications(export_path=self.export_path, limit=7), 7
+        )
+        checkpoint = ZooniverseImportState.objects.get().checkpoint
+        self.assertEqual(checkpoint["offset"], 0)
+
+        self.assertEqual(import_classifications(export_path=self.export_path), 13)
+        self.assertEqual(ZooniverseClassification.objects.count(), 20)
+        import_state = ZooniverseImportState.objects.get()
+        self.assertIsNone(import_state.checkpoint)
+        self.assertEqual(import_state.watermark, 20)
+
+
+@skipUnless(connection.vendor == "postgresql", "The COPY loader requires PostgreSQL")
+class CopyLoaderTestCase(TestCase):
+    def setUp(self):
+        survey = ZooniverseSurvey.objects.create(name="TESS")
+        target = ZooniverseTarget.objects.create(survey=survey, identifier="1")
+        self.subject = ZooniverseSubject.objects.create(
+            subject_id=1000,
+            target=target,
+            subject_set=ZooniverseSubjectSet.objects.create(subject_set_id=1),
+            metadata={},
+        )
+        self.loader = get_loader(
+            ZooniverseClassification,
+            [
+                "classification_id",
+                "subject_id",
+                "user_id",
+                "timestamp",
+                "annotation",
+                "marks_extracted",
+            ],
+            COPY,
+        )
+        self.mark_loader = get_loader(
+            ZooniverseMark,
+            [
+                "classification_id",
+                "task",
+                "task_index",
+                "mark_index",
+                "tool",
+                "x",
+                "width",
+            ],
+            COPY,
+        )
+
+    def classification(self, classification_id, user_id):
+        return self.loader.prepare(
+            {
+                "classification_id": classification_id,
+                "subject_id": self.subject.pk,
+                "user_id": user_id,
+                "timestamp": "2024-01-01 12:00:00 UTC",
+                "annotation": '[{"task": "T0", "value": []}]',
+                "marks_extracted": user_id is None,
+            }
+        )
+
+    def test_load(self):
+        self.assertEqual(
+            self.loader.load([self.classification(1, None), self.classification(2, 5)]),
+            2,
+        )
+        self.assertEqual(
+            self.mark_loader.load(
+                [
+                    self.mark_loader.prepare(
+                        {
+                            "classification_id": 1,
+                            "task": "T0",
+                            "task_index": 0,
+                            "mark_index": 0,
+                            "tool": None,
+                            "x": 2459000.5,
+                            "width": 0.1,
+                        }
+                    )
+                ]
+            ),
+            1,
+        )
+
+        first, second = ZooniverseClassification.objects.order_by("classification_id")
+        self.assertIsNone(first.user_id)
+        self.assertTrue(first.marks_extracted)
+        self.assertEqual(second.user_id, 5)
+        self.assertFalse(second.marks_extracted)
+        self.assertEqual(first.timestamp, datetime(2024, 1, 1, 12, tzinfo=timezone.utc))
+        self.assertEqual(first.annotation, [{"task": "T0", "value": []}])
+        self.assertIsNotNone(first.created)
+        self.assertIsNone(ZooniverseMark.objects.get().tool)
+
+        # Rows which already exist are skipped, and not counted or returned
+        self.assertEqual(
+            self.loader.load([self.classification(2, 5), self.classification(3, 6)]),
+            1,
+        )
+        self.assertEqual(
+            self.loader.load(
+                [self.classification(3, 6), self.classification(4, 7)],
+                returning="subject_id",
+            ),
+            [self.subject.pk],
+        )
+        self.assertEqual(ZooniverseClassification.objects.count(), 4)
+
+
+class DroppingExportReader(ExportReader):
+    """
+    Drops the connection after reading drop_after bytes, the first time it's read.
+    """
+
+    def __init__(self, *args, drop_after, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.drop_after = drop_after
+
+    def _chunks(self):
+        for chunk in super()._chunks():
+            if self.drop_after is not None:
+                if len(chunk) >= self.drop_after:
+                    yield chunk[: self.drop_after]
+                    self.drop_after = None
+                    raise requests.ConnectionError()
+                self.drop_after -= len(chunk)
+            yield chunk
+
+
+class ExportReaderTestCase(TestCase):
+    def test_retry_within_multi_line_field(self):
+        with tempfile.TemporaryDirectory() as export_dir:
+            export_path = Path(export_dir) / "export.csv"
+            export_path.write_bytes(b'id,notes\r\n1,"first\nsecond"\r\n2,third\r\n')
+            export = DroppingExportReader(None, path=export_path, drop_after=19)
+
+            rows = []
+            with self.assertRaises(requests.ConnectionError):
+                for row in export:
+                    rows.append(row)
+            self.assertEqual(rows, [])
+            self.assertEqual(export.offset, len(b"id,notes\r\n"))
+
+            rows.extend(export)
+            self.assertEqual(
+                rows,
+                [{"id": "1", "notes": "first\nsecond"}, {"id": "2", "notes": "third"}],
+            )
+            self.assertEqual(export.offset, export_path.stat().st_size)
+
+
+class PeakFinderTestCase(TestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(0)
+        n = 5000
+        # Two-minute cadence with a gap, in TDB like TESS light curves
+        times = 2459000.0 + numpy.arange(n) * 2 / 1440
+        times[n // 2 :] += 5
+        # Rounded so that some ranges have tied peaks
+        flux = numpy.round(rng.normal(100, 10, n))
+        mask = rng.random(n) < 0.05
+        mask[1000:1100] = True
+        # NaN fluxes are masked, as they are when light curves are read
+        flux[rng.random(n) < 0.01] = numpy.nan
+        mask |= numpy.isnan(flux)
+        timeseries = TimeSeries(
+            time=Time(times, format="jd", scale="tdb"),
+            data={"flux": Masked(units.Quantity(flux, "electron/s"), mask=mask)},
+        )
+
+        survey = ZooniverseSurvey.objects.create(name="TESS")
+        target = ZooniverseTarget.objects.create(survey=survey, identifier="1")
+        context = TargetContext(target)
+        context.data = timeseries
+        self.aggregator = PeakGrouperTargetAggregator(target, context)
+
+        # Ranges from a few cadences to a few days, including some which are entirely in
+        # the gap, entirely masked or outside the light curve
+        annotations = 1000
+        x_mid = rng.uniform(times[0] - 1, times[-1] + 1, annotations)
+        width = rng.exponential(0.2, annotations)
+        x_mid[:10] = (times[n // 2 - 1] + times[n // 2]) / 2
+        width[:10] = 1
+        x_mid[10:20] = times[1050]
+        width[10:20] = 0.01
+        self.x_min = x_mid - width
+        self.x_max = x_mid + width
+
+    def test_peaks_match_group_between(self):
+        expected = TargetAggregator.groups_between(
+            self.aggregator, self.x_min, self.x_max
+        )
+        groups = self.aggregator.groups_between(self.x_min, self.x_max)
+        self.assertTrue(numpy.isnan(expected).any())
+        numpy.testing.assert_array_equal(groups, expected)
+
+
+class GenerateImageTestCase(TestCase):
+    def test_sparse_points_are_drawn(self):
+        rng = numpy.random.default_rng(0)
+        n = 50
+        timeseries = TimeSeries(
+            time=Time(2459000.0 + numpy.linspace(0, 80, n), format="jd", scale="tdb"),
+            data={
+                "flux": units.Quantity(rng.normal(100, 10, n), "electron/s"),
+                "flux_err": units.Quantity(numpy.full(n, 5.0), "electron/s"),
+            },
+        )
+        for figsize in ((15, 10), (3, 2)):
+            fig = generate_image(timeseries, figsize=figsize, sigma=None)
+            try:
+                (points,) = fig.axes[0].lines
+                self.assertEqual(len(points.get_xdata()), n)
+            finally:
+                pyplot.close(fig)
+
+
+class LightcurveImageTestCase(TestCase):
+    def setUp(self):
+        self.survey = ZooniverseSurvey.objects.create(
+            name="TESS", fetch_data_method="TESS"
+        )
+        self.target = ZooniverseTarget.objects.create(
+            survey=self.survey, identifier="1"
+        )
+        ZooniverseSubject.objects.create(
+            subject_id=1000,
+            target=self.target,
+            subject_set=ZooniverseSubjectSet.objects.create(subject_set_id=1),
+            metadata={},
+            data_url="/nonexistent/lightcurve.fits",
+        )
+
+    def test_not_requested_without_fetch_data_method(self):
+        self.survey.fetch_data_method = None
+        self.survey.save()
+        target = ZooniverseTarget.objects.get(pk=self.target.pk)
+        self.assertIsNone(target.lightcurve_image)
+        self.assertTrue(target.lightcurve_image_unavailable)
+        self.assertIsNone(target.render_requested)
+
+    def test_render_without_data_marks_unavailable(self):
+        self.assertFalse(render_lightcurve_image.call(self.target.pk))
+        target = ZooniverseTarget.objects.get(pk=self.target.pk)
+        self.assertIsNone(target.render_requested)
+        self.assertIsNotNone(target.lightcurve_unavailable)
+        self.assertIsNone(target.lightcurve_image)
+        self.assertTrue(target.lightcurve_image_unavailable)
+        self.assertIsNone(target.render_requested)
+
+
+class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class PrefetchLightcurvesTestCase(TestCase):
+    def setUp(self):
+        self.fits_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        for i in range(2):
+            fits.BinTableHDU.from_columns(
+                [
+                    fits.Column(name="TIME", format="D", array=numpy.arange(100) + i),
+                    fits.Column(name="FLUX", format="E", array=numpy.ones(100)),
+                ]
+            ).writeto(Path(self.fits_dir.name) / f"lc{i}.fits")
+
+        self.server = ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            partial(QuietHTTPRequestHandler, directory=self.fits_dir.name),
+        )
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        # Accepts connections but never responds
+        self.stalled = socket.create_server(("127.0.0.1", 0))
+
+        survey = ZooniverseSurvey.objects.create(name="TESS", fetch_data_method="TESS")
+        subject_set = ZooniverseSubjectSet.objects.create(subject_set_id=1)
+        port = self.server.server_address[1]
+        self.urls = [
+            f"http://127.0.0.1:{port}/lc0.fits",
+            f"http://127.0.0.1:{port}/lc1.fits",
+            f"http://127.0.0.1:{port}/missing.fits",
+            f"http://127.0.0.1:{self.stalled.getsockname()[1]}/lc0.fits",
+        ]
+        for i, url in enumerate(self.urls):
+            target = ZooniverseTarget.objects.create(survey=survey, identifier=str(i))
+            ZooniverseSubject.objects.create(
+                subject_id=1000 + i,
+                target=target,
+                subject_set=subject_set,
+                metadata={},
+                data_url=url,
+            )
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.stalled.close()
+        self.fits_dir.cleanup()
+        self.cache_dir.cleanup()
+
+    def test_prefetch_into_cache(self):
+        with override_settings(
+            LIGHTCURVE_CACHE_DIR=self.cache_dir.name, LIGHTCURVE_STORE_DIR=None
+        ):
+            output = io.StringIO()
+            with redirect_stdout(output):
+                call_command(
+                    "prefetch_lightcurves", "--all", "--retries=0", "--timeout=0.5"
+                )
+            self.assertIn("Downloaded 2 light curves (2 failed)", output.getvalue())
+
+            cache = get_lightcurve_cache()
+            for i, url in enumerate(self.urls[:2]):
+                self.assertEqual(
+                    cache.get(url).read_bytes(),
+                    (Path(self.fits_dir.name) / f"lc{i}.fits").read_bytes(),
+                )
+            for url in self.urls[2:]:
+                self.assertIsNone(cache.get(url))
@@ -28,7 +28,7 @@ class ZooniverseTargetListView(LoginRequiredMixin, ListView):
     paginate_by = 50
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().select_related("survey")
         search = self.request.GET.get("search")
         if search:
             queryset = queryset.filter(identifier__icontains=search) | queryset.filter(